@@ -0,0 +1,110 @@
+import bk7084 as bk
+import numpy as np
+from bk7084.math import Mat4
+from components import component_geometry
+
+"""
+This file contains the MeshBaker, which collapses all the component meshes of a
+building into a single mesh.
+
+Building the Skyscraper, Highrise and Office classes adds every floor and wall as
+its own mesh, parented to the building. That is convenient to write, but a city
+ends up with thousands of tiny meshes that all need a draw call and a transform
+update every frame.
+
+The MeshBaker can be used in place of the app while constructing a building: it
+offers the same `spawn_building` and `add_mesh(mesh, parent=...)` methods, but
+only records the meshes and their transforms. Calling `bake` then transforms all
+recorded geometry into the space of the building and merges it into one mesh,
+with one sub-mesh per material (see `bk.SubMesh` in 04_building_generation/ex02.py).
+"""
+
+
+class BakeNode:
+    """A mesh recorded by the MeshBaker, it mimics the object returned by
+    `app.add_mesh`.
+    """
+    def __init__(self, mesh=None, parent=None):
+        self.mesh = mesh
+        self.parent = parent
+        self.transform = Mat4.identity()
+
+    def set_transform(self, transform):
+        self.transform = transform
+
+    def set_visible(self, visible):
+        pass
+
+    def world_transform(self):
+        """Returns the transform of the node relative to the building."""
+        transform = self.transform
+        node = self.parent
+        while node is not None:
+            transform = node.transform * transform
+            node = node.parent
+        return transform
+
+
+class MeshBaker:
+    """Records the meshes of a building and bakes them into a single mesh."""
+    def __init__(self):
+        self._nodes = []
+
+    def spawn_building(self):
+        """Returns the (empty) root node of the building."""
+        return BakeNode()
+
+    def add_mesh(self, mesh, parent=None):
+        """Records a component mesh, the mesh must be one of the components in
+        components.py.
+        """
+        node = BakeNode(mesh, parent)
+        self._nodes.append(node)
+        return node
+
+    def bake(self, app, name="BakedBuilding"):
+        """Merges all recorded meshes into a single mesh and adds it to the app.
+        Args:
+            app (bk.App):
+                The app instance.
+            name (str):
+                The name of the baked mesh.
+        Returns:
+            The object returned by `app.add_mesh` for the baked mesh.
+        """
+        # material id -> (material, positions, texcoords, triangles)
+        groups = {}
+        for node in self._nodes:
+            positions, texcoords, triangles, material = component_geometry(
+                type(node.mesh), node.mesh.w, node.mesh.h)
+            transform = np.asarray(node.world_transform(), dtype=np.float32)
+            group = groups.setdefault(id(material), (material, [], [], []))
+            group[1].append(positions @ transform[:3, :3].T + transform[:3, 3])
+            group[2].append(texcoords)
+            group[3].append(triangles)
+
+        all_positions, all_texcoords, all_triangles = [], [], []
+        materials, sub_meshes = [], []
+        vertex_count = 0
+        triangle_count = 0
+        for material, positions, texcoords, triangles in groups.values():
+            start = triangle_count
+            for p, t, tri in zip(positions, texcoords, triangles):
+                all_positions.append(p)
+                all_texcoords.append(t)
+                all_triangles.append(tri + vertex_count)
+                vertex_count += len(p)
+                triangle_count += len(tri)
+            sub_meshes.append(bk.SubMesh(start, triangle_count, len(materials)))
+            materials.append(material)
+
+        mesh = bk.Mesh()
+        mesh.name = name
+        mesh.positions = np.concatenate(all_positions)
+        mesh.texcoords = np.concatenate(all_texcoords)
+        mesh.triangles = np.concatenate(all_triangles)
+        mesh.materials = materials
+        mesh.sub_meshes = sub_meshes
+        building = app.add_mesh(mesh)
+        building.set_visible(True)
+        return building
@@ -0,0 +1,172 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from city import City, BUILDING_TYPES
+from optimizer import Optimizer
+
+"""
+Benchmarks for the hot paths of the city optimization.
+
+This script runs headless (no window, no geometry) over a matrix of grid sizes and
+building mixes, and measures:
+
+- score:    full `Optimizer.score` evaluations per second
+- delta:    single swap `Optimizer.delta_score` evaluations per second
+- swap:     `City.swap_buildings` calls per second
+- reset:    seconds per `City.reset_grid`
+- optimize: `Optimizer.optimize` steps per second, and the score after every step
+            together with the elapsed time (the score-versus-time curve); the
+            setup of `optimize` before the first step is reported separately
+
+Every case also reports the peak memory allocated by Python while building the
+city and running one optimization step. Memory tracing slows Python down, so it is
+measured in a separate pass after the timings. The results are printed (or written to --output) as JSON, for example:
+
+    python benchmark.py --sizes 10 100 --mixes default --output bench.json
+"""
+
+
+def uniform_mix(rows, cols, rng):
+    """Every building type is equally likely."""
+    return rng.integers(0, len(BUILDING_TYPES), (rows, cols))
+
+
+def residential_mix(rows, cols, rng):
+    """Mostly houses and parks, as in a suburb."""
+    return rng.choice(len(BUILDING_TYPES), (rows, cols), p=[0.1, 0.6, 0.05, 0.0, 0.0, 0.25])
+
+
+def downtown_mix(rows, cols, rng):
+    """Mostly offices and tall buildings, with few empty plots."""
+    return rng.choice(len(BUILDING_TYPES), (rows, cols), p=[0.02, 0.08, 0.4, 0.25, 0.2, 0.05])
+
+
+MIXES = {
+    # the layout created by `City.reset_grid`
+    "default": None,
+    "uniform": uniform_mix,
+    "residential": residential_mix,
+    "downtown": downtown_mix,
+}
+
+
+class ScoreCurve:
+    """A stopping rule that never stops, it records the score and elapsed time of
+    every step of `Optimizer.optimize`.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.points = []
+
+    def check(self, step, score, elapsed):
+        self.points.append((elapsed, score))
+        return None
+
+
+def throughput(function, min_time, min_calls=3):
+    """Calls `function` until `min_time` seconds and `min_calls` calls have
+    passed, and returns the number of calls per second.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time and calls >= min_calls:
+            return calls / elapsed
+
+
+def make_city(size, mix, seed):
+    """Creates a headless size x size city with the given building mix."""
+    rng = np.random.default_rng(seed)
+    city = City(None, size, size, rng=rng)
+    if MIXES[mix] is not None:
+        city.set_layout(MIXES[mix](size, size, rng))
+    return city
+
+
+def run_case(size, mix, seed, steps, strategy, min_time):
+    """Runs all benchmarks for one grid size and building mix."""
+    city = make_city(size, mix, seed)
+    optimizer = Optimizer(city, strategy=strategy)
+
+    swaps = [optimizer.random_swap_coords() for _ in range(1024)]
+    swap_index = itertools.count()
+
+    def swap():
+        (row1, col1), (row2, col2) = swaps[next(swap_index) % len(swaps)]
+        city.swap_buildings(row1, col1, row2, col2)
+
+    def delta():
+        optimizer.delta_score([swaps[next(swap_index) % len(swaps)]])
+
+    result = {
+        "size": size,
+        "mix": mix,
+        "plots": size * size,
+        "scores_per_sec": throughput(optimizer.score, min_time),
+        "swaps_per_sec": throughput(swap, min_time),
+    }
+    optimizer.sync()
+    result["deltas_per_sec"] = throughput(delta, min_time)
+
+    curve = ScoreCurve()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        optimizer.optimize(steps, stopping=[curve], reset=False)
+        elapsed = time.perf_counter() - start
+    # the curve is timed by `optimize` itself, from after its setup (rebuilding the
+    # cached scores and printing the initial layout) to the end of the last step
+    steps_elapsed = curve.points[-1][0] if curve.points else 0.0
+    result["steps_per_sec"] = len(curve.points) / steps_elapsed if steps_elapsed > 0 else 0.0
+    result["optimize_setup_sec"] = elapsed - steps_elapsed
+    result["score_curve"] = curve.points
+
+    start = time.perf_counter()
+    city.reset_grid()
+    result["reset_sec"] = time.perf_counter() - start
+
+    tracemalloc.start()
+    traced = Optimizer(make_city(size, mix, seed), strategy=strategy)
+    with contextlib.redirect_stdout(io.StringIO()):
+        traced.optimize(1, reset=False)
+    result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scoring, swapping and city construction.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 25, 50, 100, 200, 500])
+    parser.add_argument("--mixes", nargs="+", default=list(MIXES), choices=list(MIXES))
+    parser.add_argument("--steps", type=int, default=20, help="optimization steps per case")
+    parser.add_argument("--strategy", default="random", choices=list(Optimizer.STRATEGIES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per throughput measurement")
+    parser.add_argument("--output", help="write the JSON results to this file instead of printing them")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for mix in args.mixes:
+            results.append(run_case(size, mix, args.seed, args.steps, args.strategy, args.min_time))
+
+    report = json.dumps({"strategy": args.strategy, "seed": args.seed, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 from bk7084.math import *
 from components import *
-from random import randint
+from baking import MeshBaker
 import math
-import random
+import numpy as np
 
 """
 This file contains the Skyscraper, Highrise, and Office classes.
@@ -52,11 +52,18 @@ class Skyscraper:
             Number of floors to generate.
         max_width (float):
             The maximum width for each component.
+        bake (bool):
+            Whether to bake all components into a single mesh, see baking.py.
+        rng (np.random.Generator):
+            The random number generator used to pick the components.
     """
-    def __init__(self, app, num_floors, max_width):
+    def __init__(self, app, num_floors, max_width, bake=True, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
         self.num_floors = num_floors
-        # Spawn the building and save the reference to the building
-        self.building = app.spawn_building()
+        # Spawn the building and save the reference to the building, when baking
+        # the components are recorded by a MeshBaker instead of added to the app
+        target = MeshBaker() if bake else app
+        self.building = target.spawn_building()
         self.building.set_visible(True)
 
         ground_floor = [SkyscraperDoor, SkyscraperWindow3, SkyscraperWindow3R, SkyscraperWindow4]
@@ -71,23 +78,23 @@ class Skyscraper:
         }
 
         half = math.floor(max_width/2)
-        sides_h = [SelectRandomComponent(ground_floor) for i in range(half)]
+        sides_h = [SelectRandomComponent(ground_floor, rng) for i in range(half)]
         sides_ground = []
         sides_ground.extend(sides_h)
         if max_width % 2 == 1:
-            sides_ground.append(SelectRandomComponent(ground_floor))
+            sides_ground.append(SelectRandomComponent(ground_floor, rng))
         sides_h = [replacement_map.get(cls, cls) for cls in reversed(sides_h)]
         sides_ground.extend(sides_h)
 
-        sides_h = [SelectRandomComponent(upper_floors) for i in range(half)]
+        sides_h = [SelectRandomComponent(upper_floors, rng) for i in range(half)]
         sides_upper = []
         sides_upper.extend(sides_h)
         if max_width % 2 == 1:
-            sides_upper.append(SelectRandomComponent(ground_floor))
+            sides_upper.append(SelectRandomComponent(ground_floor, rng))
         sides_h = [replacement_map.get(cls, cls) for cls in reversed(sides_h)]
         sides_upper.extend(sides_h)
 
-        rotate_factor = randint(3, 15)
+        rotate_factor = int(rng.integers(3, 16))
 
         for i in range(self.num_floors):
             rotation = Mat4.from_rotation_y(rotate_factor * i, degrees=True)
@@ -97,7 +104,10 @@ class Skyscraper:
                     list = sides_ground if i == 0 else sides_upper
                     walls = [list[j], list[k], list[j], list[k]]
                     transform = rotation * Mat4.from_translation(Vec3(j - max_width/2 + 0.5, i, k - max_width/2 + 0.5)) 
-                    CreateVoxel(app, self.building, transform, BasicFloor, walls, include)
+                    CreateVoxel(target, self.building, transform, BasicFloor, walls, include)
+
+        if bake:
+            self.building = target.bake(app, "Skyscraper")
 
 
 class Highrise:
@@ -111,11 +121,18 @@ class Highrise:
             Number of floors to generate.
         max_width (float):
             The maximum width for each component.
+        bake (bool):
+            Whether to bake all components into a single mesh, see baking.py.
+        rng (np.random.Generator):
+            The random number generator used to pick the components.
     """
-    def __init__(self, app, num_floors, max_width):
+    def __init__(self, app, num_floors, max_width, bake=True, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
         self.num_floors = num_floors
-        # Spawn the building and save the reference to the building
-        self.building = app.spawn_building()
+        # Spawn the building and save the reference to the building, when baking
+        # the components are recorded by a MeshBaker instead of added to the app
+        target = MeshBaker() if bake else app
+        self.building = target.spawn_building()
         self.building.set_visible(True)
 
         ground_floor = [HighriseDoor, HighriseLowerWindow]
@@ -126,19 +143,19 @@ class Highrise:
 
         half = math.floor(max_width/2)
         max_width = half * 2
-        sides_h = [SelectRandomComponent(ground_floor) for i in range(half)]
+        sides_h = [SelectRandomComponent(ground_floor, rng) for i in range(half)]
         sides_ground = []
         sides_ground.extend(sides_h)
         if max_width % 2 == 1:
-            sides_ground.append(SelectRandomComponent(ground_floor))
+            sides_ground.append(SelectRandomComponent(ground_floor, rng))
         sides_h = [replacement_map.get(cls, cls) for cls in reversed(sides_h)]
         sides_ground.extend(sides_h)
 
-        sides_h = [SelectRandomComponent(upper_floors) for i in range(half)]
+        sides_h = [SelectRandomComponent(upper_floors, rng) for i in range(half)]
         sides_upper = []
         sides_upper.extend(sides_h)
         if max_width % 2 == 1:
-            sides_upper.append(SelectRandomComponent(ground_floor))
+            sides_upper.append(SelectRandomComponent(ground_floor, rng))
         sides_h = [replacement_map.get(cls, cls) for cls in reversed(sides_h)]
         sides_upper.extend(sides_h)
 
@@ -151,7 +168,10 @@ class Highrise:
                         list = sides_ground if i == 0 else sides_upper
                         walls = [list[j], list[k], list[j], list[k]]
                         transform = rotation * Mat4.from_translation(Vec3(j - half/2 + 0.5, i, k - half/2 + 0.5)) * Mat4.from_translation(Vec3(0,0,1.1))
-                        CreateVoxel(app, self.building, transform, BasicFloor, walls, include)
+                        CreateVoxel(target, self.building, transform, BasicFloor, walls, include)
+
+        if bake:
+            self.building = target.bake(app, "Highrise")
 
 
 class Office:
@@ -165,11 +185,18 @@ class Office:
             Number of floors to generate.
         max_width (float):
             The maximum width for each component.
+        bake (bool):
+            Whether to bake all components into a single mesh, see baking.py.
+        rng (np.random.Generator):
+            The random number generator used to pick the components.
     """
-    def __init__(self, app, num_floors, max_width):
+    def __init__(self, app, num_floors, max_width, bake=True, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
         self.num_floors = num_floors
-        # Spawn the building and save the reference to the building
-        self.building = app.spawn_building()
+        # Spawn the building and save the reference to the building, when baking
+        # the components are recorded by a MeshBaker instead of added to the app
+        target = MeshBaker() if bake else app
+        self.building = target.spawn_building()
         self.building.set_visible(True)
 
         ground_floor = [OfficeDoor, OfficeWindow]
@@ -179,24 +206,24 @@ class Office:
         replacement_map = {}
 
         half = math.floor(max_width/2)
-        sides_h = [SelectRandomComponent(ground_floor) for i in range(half)]
+        sides_h = [SelectRandomComponent(ground_floor, rng) for i in range(half)]
         sides_ground = []
         sides_ground.extend(sides_h)
         if max_width % 2 == 1:
-            sides_ground.append(SelectRandomComponent(ground_floor))
+            sides_ground.append(SelectRandomComponent(ground_floor, rng))
         sides_h = [replacement_map.get(cls, cls) for cls in reversed(sides_h)]
         sides_ground.extend(sides_h)
 
-        sides_h = [SelectRandomComponent(upper_floors) for i in range(half)]
+        sides_h = [SelectRandomComponent(upper_floors, rng) for i in range(half)]
         sides_upper = []
         sides_upper.extend(sides_h)
         if max_width % 2 == 1:
-            sides_upper.append(SelectRandomComponent(ground_floor))
+            sides_upper.append(SelectRandomComponent(ground_floor, rng))
         sides_h = [replacement_map.get(cls, cls) for cls in reversed(sides_h)]
         sides_upper.extend(sides_h)
 
-        skip_x = randint(0,max_width-3)
-        skip_z = randint(0,max_width-3)
+        skip_x = int(rng.integers(0, max_width-2))
+        skip_z = int(rng.integers(0, max_width-2))
 
         for i in range(self.num_floors):
             for j in range(max_width):
@@ -206,37 +233,40 @@ class Office:
                     list = sides_ground if i == 0 else sides_upper
                     walls = [list[j], list[k], list[j], list[k]]
                     transform = Mat4.from_translation(Vec3(j - max_width/2 + 0.5, i, k - max_width/2 + 0.5))
-                    CreateVoxel(app, self.building, transform, BasicFloor, walls, include)
+                    CreateVoxel(target, self.building, transform, BasicFloor, walls, include)
+
+        if bake:
+            self.building = target.bake(app, "Office")
 
-def SelectRandomComponent(components):
+def SelectRandomComponent(components, rng):
     count = len(components)
     if count <= 0:
         return
     if count <=1:
         return components[0]
-    return components[randint(0, count-1)]
+    return components[int(rng.integers(0, count))]
 
 def CreateVoxel(app, parent, pos, roof, walls, include):
     # ground
-    floor1 = app.add_mesh(BasicFloor(), parent=parent)
+    floor1 = app.add_mesh(shared_mesh(BasicFloor), parent=parent)
     floor1.set_transform(pos)
     floor1.set_visible(True)
 
     if(include[0]):
         # floor overhang
-        floor3 = app.add_mesh(BasicFloor(), parent=floor1)
+        floor3 = app.add_mesh(shared_mesh(BasicFloor), parent=floor1)
         floor3.set_transform(Mat4.from_rotation_x(180, True))
         floor3.set_visible(True)
 
     if(include[1]):
         # roof 
-        floor2 = app.add_mesh(roof(), parent=floor1)
+        floor2 = app.add_mesh(shared_mesh(roof), parent=floor1)
         floor2.set_transform(Mat4.from_translation(Vec3(0, 1, 0)))
         floor2.set_visible(True)
     # walls
     for i in range(4):
         if(not include[i + 2]): continue
-        wall = app.add_mesh(walls[i](1, 1), parent=floor1)
+        wall = app.add_mesh(shared_mesh(walls[i], 1, 1), parent=floor1)
         transform = Mat4.from_rotation_y((math.pi/2) * i) 
         transform *= Mat4.from_translation(Vec3(0, 1 / 2, 1 / 2))
         wall.set_transform(transform)
@@ -248,10 +278,11 @@ park_model = bk.Mesh.load_from(bk.res_path("./assets/park.obj"))
 
 
 class Park:
-    def __init__(self, app):
+    def __init__(self, app, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
         self.building = app.add_mesh(park_model)
         self.building.set_visible(True)
-        angle = random.randint(0, 3) * 90
+        angle = int(rng.integers(0, 4)) * 90
         self.pre_transform = (
             Mat4.from_translation(Vec3(0, 1.4, 0))
             * Mat4.from_scale(Vec3(0.5))
@@ -264,10 +295,11 @@ house_model = bk.Mesh.load_from(bk.res_path("./assets/house.obj"))
 
 
 class House:
-    def __init__(self, app):
+    def __init__(self, app, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
         self.building = app.add_mesh(house_model)
         self.building.set_visible(True)
-        angle = random.randint(0, 3) * 90
+        angle = int(rng.integers(0, 4)) * 90
         self.pre_transform = (
             Mat4.from_scale(Vec3(0.5))
             * Mat4.from_translation(Vec3(0, 6.8, 0))
@@ -1,10 +1,11 @@
+from collections import OrderedDict, defaultdict
 from enum import Enum
+from functools import lru_cache, partial
 
 import numpy as np
 
 from buildings import Office, Highrise, Skyscraper, House, Park
 from components import material_basic_ground
-from random import randint, randrange, shuffle
 from bk7084.math import Mat4, Vec3
 import bk7084 as bk
 import types
@@ -41,6 +42,125 @@ Skyscraper.type = BuildingType.SKYSCRAPER
 House.type = BuildingType.HOUSE
 Park.type = BuildingType.PARK
 
+# lookup table from the integer value of a building type to the enum member
+BUILDING_TYPES = tuple(BuildingType)
+
+class LazyBuilding:
+    """A handle to a building whose geometry is only constructed when it is first
+    needed, either by `build` or by accessing any attribute of the building (e.g.
+    `handle.building`). The building type is known right away without building.
+
+    Args:
+        building_type (BuildingType):
+            The type of the building.
+        factory (callable):
+            Called without arguments to construct the building.
+        key (tuple):
+            The (type, num_floors, width) of the building in a `BuildingPool`.
+    """
+    def __init__(self, building_type, factory, key=None):
+        self.type = building_type
+        self.key = key
+        self._factory = factory
+        self._building = None
+
+    @property
+    def built(self) -> bool:
+        """Returns whether the geometry of the building has been constructed."""
+        return self._building is not None
+
+    def build(self):
+        """Constructs the building if needed and returns it."""
+        if self._building is None:
+            self._building = self._factory()
+            self._factory = None
+        return self._building
+
+    def __getattr__(self, name):
+        # only called for attributes the handle itself does not have
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.build(), name)
+
+
+class BuildingPool:
+    """Keeps built buildings that were removed from the city, grouped by their
+    (type, num_floors, width) key, so that a new building with the same key can
+    reuse their geometry instead of generating it again. Pooled buildings are
+    hidden until they are taken out again.
+    """
+    def __init__(self):
+        self._free = defaultdict(list)
+
+    def __len__(self):
+        return sum(len(buildings) for buildings in self._free.values())
+
+    def take(self, key):
+        """Returns a pooled building with the given key, or None if there is none."""
+        buildings = self._free.get(key)
+        if not buildings:
+            return None
+        building = buildings.pop()
+        building.building.set_visible(True)
+        return building
+
+    def release(self, building):
+        """Hides a building and adds it to the pool. Buildings that were never built
+        have no geometry to reuse and are dropped.
+        """
+        if isinstance(building, LazyBuilding) and building.built and building.key is not None:
+            building.building.set_visible(False)
+            self._free[building.key].append(building)
+
+
+# (row offset, col offset) of the neighbourhoods in `NeighbourTables`
+NEIGHBOURS_4 = ((-1, 0), (0, -1), (0, 1), (1, 0))
+NEIGHBOURS_8 = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+NEIGHBOURS_R3 = tuple((dr, dc) for dr in range(-3, 4) for dc in range(-3, 4) if (dr, dc) != (0, 0))
+
+
+class NeighbourTables:
+    """Precomputed neighbour indices of every plot of a grid with a given shape.
+
+    Plots are numbered like in the City, `index = row * cols + col`. For every plot
+    and every offset of a neighbourhood, the tables hold the index of the
+    neighbouring plot, or `size` (= rows * cols) when the neighbour lies outside
+    the grid. Append one sentinel value to a flat array of plot values and the
+    neighbours of many plots can be gathered with a single fancy-index operation:
+
+    >>> flat = np.append(city.type_grid.ravel(), 255)
+    >>> flat[tables.index8[plots]]  # shape (len(plots), 8)
+
+    The `distance*` arrays hold the distance of every offset to the plot itself.
+
+    Args:
+        rows (int):
+            The number of rows in the grid.
+        cols (int):
+            The number of columns in the grid.
+    """
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.size = rows * cols
+        self.index4, self.distance4 = self._table(NEIGHBOURS_4)
+        self.index8, self.distance8 = self._table(NEIGHBOURS_8)
+        self.index_r3, self.distance_r3 = self._table(NEIGHBOURS_R3)
+
+    def _table(self, offsets):
+        offsets = np.array(offsets)
+        rows = np.arange(self.rows)[:, None, None] + offsets[:, 0]
+        cols = np.arange(self.cols)[None, :, None] + offsets[:, 1]
+        inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        index = np.where(inside, rows * self.cols + cols, self.size).astype(np.int32)
+        return index.reshape(self.size, len(offsets)), np.hypot(offsets[:, 0], offsets[:, 1])
+
+
+@lru_cache(maxsize=None)
+def neighbour_tables(rows, cols) -> NeighbourTables:
+    """Returns the (cached) neighbour tables of a grid with the given shape."""
+    return NeighbourTables(rows, cols)
+
 
 class City:
     """A city class that procedurally generates a city grid given a number of rows
@@ -85,30 +205,111 @@ class City:
     `get_building`, `set_building`, and `get_building_type` to get the building at a
     specific row and column, set the building at a specific row and column, and get
     the type of the building at a specific row and column, respectively.
+
+    Internally the building objects live in a table (`_buildings`) and the grid only
+    stores integers: `_plot_index` holds the index into that table for every plot
+    and `_types` holds the `BuildingType` value of every plot, both as NumPy arrays
+    with shape (rows, cols). Reading types never touches the building objects, and
+    swapping two buildings only swaps two entries in each array.
+
+    Passing `None` as the app creates a headless city: there is no ground, no grid
+    and no building geometry, only the building types of the plots are tracked.
+    This is all the optimizer needs, so headless cities can be optimized without a
+    window. Use `attach_app` to build the geometry of the final layout.
+
+    Building geometry is constructed lazily: `construct_building` only stores a
+    `LazyBuilding` handle, and the geometry is built the first time the plot is
+    placed by `update` (or when the handle is used). With `builds_per_update` set,
+    `update` builds at most that many buildings per frame, so the first frame shows
+    up right away and the city fills in over the next frames.
+
+    Buildings removed by `clear_grid`, `reset_grid` or `construct_building` go to a
+    `BuildingPool`, and `construct_building` takes a building with the same type,
+    number of floors and width from the pool before generating a new one, so
+    repeated resets reuse the existing geometry.
     """
-    def __init__(self, app, plots_per_col=8, plots_per_row=8, plot_width=3):
+    def __init__(self, app, plots_per_col=8, plots_per_row=8, plot_width=3, rng=None, builds_per_update=None,
+                 sunlight_cache_size=128):
         """Initializes the city grid.
         Args:
             app (bk.App):
-                The app instance.
+                The app instance, or None for a headless city.
             plots_per_col (int):
                 The number of plots per column.
             plots_per_row (int):
                 The number of plots per row.
             plot_width (float):
                 The width of each plot.
+            rng (np.random.Generator):
+                The random number generator used for the layout and the buildings,
+                pass a seeded generator to make the city reproducible. The
+                buildings use a child generator spawned from it, so headless and
+                windowed cities with the same seed get the same layouts.
+            builds_per_update (int):
+                The maximum number of buildings whose geometry `update` constructs
+                per call, None builds all pending buildings at once.
+            sunlight_cache_size (int):
+                The number of layouts whose sunlight scores are kept, see
+                `compute_sunlight_scores`.
         """
         self._app = app
+        self._rng = rng if rng is not None else np.random.default_rng()
+        # the buildings draw from their own child stream, so the layout and the
+        # optimizer (which shares `rng`) draw the same numbers with or without an app
+        self._building_rng = self._rng.spawn(1)[0]
         self._plots_per_col = plots_per_col
         self._plots_per_row = plots_per_row
         self._plot_width = plot_width
-        self._plots = [None] * plots_per_col * plots_per_row
-        self._ground = self.create_ground(app, self.width, self.height, *self.spacing)
-        self._grid = self.create_grid(app, self.width, self.height, *self.spacing)
-        app.update_shadow_map_ortho_proj(max(plots_per_col, plots_per_row) * plot_width)
+        self.builds_per_update = builds_per_update
+        self._buildings = [None] * plots_per_col * plots_per_row
+        self._pool = BuildingPool()
+        # bumped whenever a building in `_buildings` is replaced, see `layout_key`
+        self._buildings_version = 0
+        # layout key -> sunlight scores, the most recently used last
+        self._sunlight_cache = OrderedDict()
+        self.sunlight_cache_size = sunlight_cache_size
+        self._plot_index = np.arange(plots_per_col * plots_per_row, dtype=np.int32).reshape(
+            plots_per_row, plots_per_col)
+        self._types = np.zeros((plots_per_row, plots_per_col), dtype=np.uint8)
+        # plots (as row * cols + col) whose building changed since the last update
+        self._dirty = set()
+        self._ground = None
+        self._grid = None
+        if app is not None:
+            self.create_scene(app)
         # Reset (initialize) the city grid by assigning building to each plot
         self.reset_grid()
 
+    def create_scene(self, app):
+        """Creates the ground and the grid of the city and fits the shadow map."""
+        self._ground = self.create_ground(app, self.width, self.height, *self.spacing)
+        self._grid = self.create_grid(app, self.width, self.height, *self.spacing)
+        app.update_shadow_map_ortho_proj(max(self._plots_per_col, self._plots_per_row) * self._plot_width)
+
+    def attach_app(self, app):
+        """Attaches an app to a headless city.
+        This method will create the scene and construct every building in the
+        current layout, their geometry is built by the following updates.
+        Args:
+            app (bk.App):
+                The app instance.
+        """
+        self._app = app
+        self.create_scene(app)
+        for row in range(self._plots_per_row):
+            for col in range(self._plots_per_col):
+                self.construct_building(row, col, self.get_building_type(row, col))
+
+    @property
+    def rng(self) -> np.random.Generator:
+        """Returns the random number generator of the city."""
+        return self._rng
+
+    @property
+    def headless(self) -> bool:
+        """Returns whether the city has no app and therefore no geometry."""
+        return self._app is None
+
     @staticmethod
     def create_ground(app, width, height, spacing_x, spacing_y):
         """Creates the ground of the city."""
@@ -135,7 +336,8 @@ class City:
         return grid
 
     def set_ground_visibility(self, visible: bool):
-        self._ground.set_visible(visible)
+        if self._ground is not None:
+            self._ground.set_visible(visible)
 
     @property
     def width(self) -> float:
@@ -192,9 +394,9 @@ class City:
         buildings.extend([BuildingType(4) for i in range(sk_c)])
         buildings.extend([BuildingType(5) for i in range(pk_c)])
         r_c = cells - len(buildings)
-        buildings.extend([BuildingType(randint(0, 5)) for i in range(r_c)])
+        buildings.extend([BuildingType(int(self._rng.integers(0, 6))) for i in range(r_c)])
 
-        shuffle(buildings)
+        self._rng.shuffle(buildings)
 
         for row in range(self._plots_per_row):
             for col in range(self._plots_per_col):
@@ -203,12 +405,27 @@ class City:
                 building_type = buildings.pop()
                 self.construct_building(row, col, building_type)
 
+    def set_layout(self, types):
+        """Constructs a building of the given type on every plot.
+        Args:
+            types (np.ndarray):
+                The building type of every plot as an integer array with shape
+                (rows, cols), e.g. the `type_grid` of another city.
+        """
+        for row in range(self._plots_per_row):
+            for col in range(self._plots_per_col):
+                self.construct_building(row, col, BUILDING_TYPES[types[row, col]])
+
     def clear_grid(self):
         """Clears the city grid.
         This method will clear the plots and set all plots to empty.
         """
         for i in range(self._plots_per_col * self._plots_per_row):
-            self._plots[i] = None
+            self._pool.release(self._buildings[i])
+            self._buildings[i] = None
+        self._buildings_version += 1
+        self._plot_index[...] = np.arange(self._plot_index.size).reshape(self._plot_index.shape)
+        self._types[...] = BuildingType.EMPTY.value
 
     @property
     def rows(self) -> int:
@@ -230,28 +447,46 @@ class City:
             building_type (BuildingType):
                 The type of building to construct.
         """
-        building = None
+        factory = None
+        num_floors = None
 
-        if building_type is BuildingType.HOUSE:
-            building = House(self._app)
-        elif building_type is BuildingType.OFFICE:
-            # TODO: replace the following line with your own code to create an office
-            num_floors = randint(3, 8)
-            building = Office(self._app, num_floors, 6)
-        elif building_type is BuildingType.HIGHRISE:
-            # TODO: replace the following line with your own code to create a highrise
-            num_floors = randint(5, 18)
-            building = Highrise(
-                self._app, num_floors, 6
-            )
-        elif building_type is BuildingType.SKYSCRAPER:
-            # TODO: replace the following line with your own code to create a skyscraper
-            num_floors = randint(6, 20)
-            building = Skyscraper(self._app, num_floors, 6)
-        elif building_type is BuildingType.PARK:
-            building = Park(self._app)
-
-        self._plots[row * self._plots_per_col + col] = building
+        if self.headless or building_type is BuildingType.EMPTY:
+            # headless cities only keep track of the building type
+            pass
+        else:
+            # the geometry is built later, with its own generator seeded now so the
+            # buildings do not depend on the order in which they are built
+            rng = np.random.default_rng(self._building_rng.integers(2 ** 63))
+            if building_type is BuildingType.HOUSE:
+                factory = partial(House, self._app, rng=rng)
+            elif building_type is BuildingType.OFFICE:
+                # TODO: replace the following line with your own code to create an office
+                num_floors = int(self._building_rng.integers(3, 9))
+                factory = partial(Office, self._app, num_floors, 6, rng=rng)
+            elif building_type is BuildingType.HIGHRISE:
+                # TODO: replace the following line with your own code to create a highrise
+                num_floors = int(self._building_rng.integers(5, 19))
+                factory = partial(
+                    Highrise, self._app, num_floors, 6, rng=rng
+                )
+            elif building_type is BuildingType.SKYSCRAPER:
+                # TODO: replace the following line with your own code to create a skyscraper
+                num_floors = int(self._building_rng.integers(6, 21))
+                factory = partial(Skyscraper, self._app, num_floors, 6, rng=rng)
+            elif building_type is BuildingType.PARK:
+                factory = partial(Park, self._app, rng=rng)
+
+        self._pool.release(self._buildings[self._plot_index[row, col]])
+        building = None
+        if factory is not None:
+            key = (building_type, num_floors, 6)
+            building = self._pool.take(key)
+            if building is None:
+                building = LazyBuilding(building_type, factory, key)
+        self._buildings[self._plot_index[row, col]] = building
+        self._buildings_version += 1
+        self._types[row, col] = building_type.value
+        self._dirty.add(row * self._plots_per_col + col)
 
     def get_building(self, row: int, col: int):
         """Returns the building at the given row and column.
@@ -261,7 +496,7 @@ class City:
             col (int):
                 The column of the plot.
         """
-        return self._plots[row * self._plots_per_col + col]
+        return self._buildings[self._plot_index[row, col]]
 
     def set_building(self, row: int, col: int, building):
         """Sets the building at the given row and column.
@@ -273,7 +508,10 @@ class City:
             building:
                 The building to set.
         """
-        self._plots[row * self._plots_per_col + col] = building
+        self._buildings[self._plot_index[row, col]] = building
+        self._buildings_version += 1
+        self._types[row, col] = BuildingType.EMPTY.value if building is None else building.type.value
+        self._dirty.add(row * self._plots_per_col + col)
 
     def get_building_type(self, row: int, col: int) -> BuildingType:
         """Returns the type of the building at the given row and column.
@@ -283,10 +521,24 @@ class City:
             col (int):
                 The column of the plot.
         """
-        if self.get_building(row, col) is None:
-            return BuildingType.EMPTY
-        else:
-            return self.get_building(row, col).type
+        return BUILDING_TYPES[self._types[row, col]]
+
+    @property
+    def neighbours(self) -> NeighbourTables:
+        """Returns the neighbour tables of the city grid, they are computed once per
+        grid shape and shared between cities.
+        """
+        return neighbour_tables(self._plots_per_row, self._plots_per_col)
+
+    @property
+    def type_grid(self) -> np.ndarray:
+        """Returns the building type of every plot as an integer array with shape
+        (rows, cols), using the values of `BuildingType`. The array is a read-only
+        view that stays in sync with the city grid.
+        """
+        types = self._types.view()
+        types.flags.writeable = False
+        return types
 
     def swap_buildings(self, row1: int, col1: int, row2: int, col2: int):
         """Swaps the building at the given rows and columns.
@@ -300,18 +552,43 @@ class City:
             col2 (int):
                 The column of the second plot.
         """
-        self._plots[row1 * self._plots_per_col + col1], self._plots[row2 * self._plots_per_col + col2] = (
-            self._plots[row2 * self._plots_per_col + col2], self._plots[row1 * self._plots_per_col + col1])
+        index, types = self._plot_index, self._types
+        index[row1, col1], index[row2, col2] = index[row2, col2], index[row1, col1]
+        types[row1, col1], types[row2, col2] = types[row2, col2], types[row1, col1]
+        self._dirty.add(row1 * self._plots_per_col + col1)
+        self._dirty.add(row2 * self._plots_per_col + col2)
+
+    def layout_key(self) -> tuple:
+        """Returns a key that identifies the current layout: which building stands
+        on which plot. Swapping two buildings and swapping them back gives the same
+        key again, replacing a building gives a new one.
+        """
+        return self._buildings_version, self._plot_index.tobytes()
 
     def compute_sunlight_scores(self) -> np.array(float):
         """Computes the sunlight scores of the city during the day. Lower scores are
         better, the best score is 1.
+        The scores of the last `sunlight_cache_size` layouts are cached (see
+        `layout_key`), so asking again for a layout that was seen before does not
+        render the city again.
         Returns:
             list:
                 The sunlight scores of the city at different times of the day, in total
                 11 scores.
         """
-        return np.array(self._app.compute_sunlight_scores()[:11])
+        if self.headless:
+            raise RuntimeError("A headless city has no app to compute sunlight scores with.")
+        key = self.layout_key()
+        scores = self._sunlight_cache.get(key)
+        if scores is None:
+            self.build_all()
+            scores = np.array(self._app.compute_sunlight_scores()[:11])
+            self._sunlight_cache[key] = scores
+            if len(self._sunlight_cache) > self.sunlight_cache_size:
+                self._sunlight_cache.popitem(last=False)
+        else:
+            self._sunlight_cache.move_to_end(key)
+        return scores.copy()
 
     def print_plots(self):
         """Prints the city grid in the console.
@@ -335,14 +612,38 @@ class City:
         )
 
     def update(self, dt, t):
-        """Updates all buildings in the city.
-        This method will update the transform of each building in the city grid.
+        """Updates the buildings in the city.
+        This method will update the transform of each building whose plot changed
+        since the last update (through `construct_building`, `set_building` or
+        `swap_buildings`). Buildings that did not move are left untouched.
+        Buildings that were not built yet are built first, at most
+        `builds_per_update` of them, the others wait for the next update.
+        """
+        self._update_plots(self.builds_per_update)
+
+    def build_all(self):
+        """Builds and places every building that is still waiting for `update`."""
+        self._update_plots(None)
+
+    def _update_plots(self, budget):
+        """Updates the transform of the buildings of the changed plots, building at
+        most `budget` (None for no limit) of them.
         """
-        for i, plot_building in enumerate(self._plots):
+        dirty = self._dirty
+        self._dirty = set()
+        for i in sorted(dirty):
+            # Get the row and column of the building
+            row = i // self._plots_per_col
+            col = i % self._plots_per_col
+            plot_building = self.get_building(row, col)
+            if isinstance(plot_building, LazyBuilding) and not plot_building.built:
+                if budget is not None and budget <= 0:
+                    self._dirty.add(i)
+                    continue
+                if budget is not None:
+                    budget -= 1
+                plot_building.build()
             if plot_building is not None:
-                # Get the row and column of the building
-                row = i // self._plots_per_col
-                col = i % self._plots_per_col
                 # Update the transform of the building according to the row and column
                 half_width = self._plots_per_col / 2
                 half_height = self._plots_per_row / 2
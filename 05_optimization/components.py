@@ -420,6 +420,66 @@ class BasicFloor(bk.Mesh):
         self.materials = [m]
 
 
+# shared mesh instances, keyed by component class and size, see `shared_mesh`
+_mesh_cache = {}
+
+
+def shared_mesh(component, w=1, h=1):
+    """Returns a shared mesh of the given component class and size.
+    The mesh is created the first time it is requested, afterwards the same mesh
+    instance is returned. Buildings add it to the app once per face, so each face
+    only differs in its transform and identical geometry is not duplicated.
+    Args:
+        component:
+            The component class, e.g. `BasicFloor` or `SkyscraperWindow1`.
+        w (float):
+            The width of the component.
+        h (float):
+            The height of the component.
+    """
+    key = (component, w, h)
+    mesh = _mesh_cache.get(key)
+    if mesh is None:
+        mesh = component(w, h)
+        _mesh_cache[key] = mesh
+    return mesh
+
+
+# plain geometry of the components, keyed by component class and size
+_geometry_cache = {}
+
+
+def component_geometry(component, w=1, h=1):
+    """Returns the geometry of a component as a tuple of (positions, texcoords,
+    triangles, material), with the first three as NumPy arrays.
+    The attributes of a bk.Mesh can only be written, not read back, so the geometry
+    is recorded by constructing the component once as a subclass that stores them
+    as plain attributes. Every component uses a single material without sub-meshes.
+    Args:
+        component:
+            The component class, e.g. `BasicFloor` or `SkyscraperWindow1`.
+        w (float):
+            The width of the component.
+        h (float):
+            The height of the component.
+    """
+    key = (component, w, h)
+    geometry = _geometry_cache.get(key)
+    if geometry is None:
+        class RecordedComponent(component):
+            positions = texcoords = triangles = materials = None
+
+        mesh = RecordedComponent(w, h)
+        geometry = (
+            np.array(mesh.positions, dtype=np.float32),
+            np.array(mesh.texcoords, dtype=np.float32),
+            np.array(mesh.triangles, dtype=np.uint32),
+            mesh.materials[0],
+        )
+        _geometry_cache[key] = geometry
+    return geometry
+
+
 '''
 class BasicWindowWall(bk.Mesh):
     def __new__(cls, *args, **kwargs):
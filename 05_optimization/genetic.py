@@ -0,0 +1,99 @@
+import numpy as np
+from scoring import random_swap_array, swap_stack
+
+"""
+This file contains the operators of the genetic algorithm strategy of the Optimizer.
+
+The population is a (P, rows, cols) array of type grids. All individuals are
+rearrangements of the same buildings, and every operator keeps it that way, so the
+number of buildings of every type set by `City.reset_grid` never changes:
+
+- crossover keeps a slice of one parent and fills the other plots with the
+  remaining buildings in the order they appear in the other parent
+- mutation swaps random pairs of plots
+
+`layout_swaps` turns the best individual back into swaps that can be applied to
+the city.
+"""
+
+
+def tournament(scores, rng, count, size=3):
+    """Returns the indices of `count` individuals, each the best of `size` randomly
+    drawn individuals.
+    """
+    entrants = rng.integers(0, len(scores), (count, size))
+    return entrants[np.arange(count), np.argmax(scores[entrants], axis=1)]
+
+
+def occurrence_rank(values):
+    """Returns for every value how many equal values come before it."""
+    order = np.argsort(values, kind="stable")
+    starts = np.searchsorted(values[order], values[order], side="left")
+    rank = np.empty(len(values), dtype=np.intp)
+    rank[order] = np.arange(len(values)) - starts
+    return rank
+
+
+def order_crossover(a, b, rng):
+    """Returns a child of two type grids with the same buildings. The child keeps a
+    random slice of the (flattened) grid `a`, the other plots get the buildings
+    that are not in that slice, in the order they appear in `b`.
+    """
+    flat_a, flat_b = a.ravel(), b.ravel()
+    start, stop = np.sort(rng.integers(0, flat_a.size + 1, 2))
+    child = np.empty_like(flat_a)
+    child[start:stop] = flat_a[start:stop]
+    # drop as many buildings of every type from b as the slice already holds
+    taken = np.bincount(flat_a[start:stop], minlength=256)
+    rest = flat_b[occurrence_rank(flat_b) >= taken[flat_b]]
+    child[:start] = rest[:start]
+    child[stop:] = rest[start:]
+    return child.reshape(a.shape)
+
+
+def mutate(population, rng, max_swaps):
+    """Applies between 0 and `max_swaps` random swaps to every individual, in place."""
+    count, rows, cols = population.shape
+    counts = rng.integers(0, max_swaps + 1, count)
+    swap_stack(population, random_swap_array(rng, rows, cols, counts, max_swaps))
+
+
+def layout_swaps(current, target):
+    """Returns a list of ((row1, col1), (row2, col2)) swaps that turn the type grid
+    `current` into `target`, which must hold the same buildings. Every swap puts at
+    least one plot in place, and two when possible.
+    """
+    cols = current.shape[1]
+    current = current.ravel().copy()
+    target = target.ravel()
+    # (has, wants) -> plots that hold `has` but should hold `wants`
+    misplaced = {}
+    for i in np.flatnonzero(current != target).tolist():
+        misplaced.setdefault((current[i], target[i]), []).append(i)
+
+    def pop(has, wants):
+        plots = misplaced.get((has, wants))
+        while plots:
+            j = plots.pop()
+            # plots can be stale, they move to another list when they change
+            if current[j] == has and target[j] == wants:
+                return j
+        return None
+
+    kinds = np.unique(target).tolist()
+    swaps = []
+    for i in np.flatnonzero(current != target).tolist():
+        if current[i] == target[i]:
+            continue
+        has, wants = current[i], target[i]
+        # prefer a plot that wants what plot i has, that fixes both plots
+        j = pop(wants, has)
+        for other in kinds:
+            if j is not None:
+                break
+            j = pop(wants, other)
+        current[i], current[j] = current[j], current[i]
+        if current[j] != target[j]:
+            misplaced.setdefault((current[j], target[j]), []).append(j)
+        swaps.append(((i // cols, i % cols), (j // cols, j % cols)))
+    return swaps
@@ -1,7 +1,7 @@
 import bk7084 as bk
 from buildings import *
 from city import City
-from optimizer import Optimizer
+from worker import OptimizerWorker
 
 """
 Exercise 05: City Optimization
@@ -130,8 +130,11 @@ center_pos = Vec3(0, np.cos(inclination), np.sin(inclination))
 starting_pos = Mat3.from_rotation_z(-np.pi * 0.5) * center_pos
 light = app.add_directional_light(Vec3(0.0) - starting_pos, bk.Color(0.8, 0.8, 0.8))
 
-city = City(app, 10, 10, 8)
-optimizer = Optimizer(city)
+# buildings are built a few per frame, so the window opens right away
+city = City(app, 10, 10, 8, builds_per_update=4)
+# the optimizer runs in a background thread, see worker.py
+worker = OptimizerWorker(city)
+worker.start()
 run_optimizer = False
 
 # Variables to avoid key spamming
@@ -201,7 +204,7 @@ def on_update(input, dt, t):
     if input.is_key_pressed(bk.KeyCode.L):
         if not is_key_l_pressed:
             is_key_l_pressed = True
-            optimizer.step(True)
+            worker.step_once(True)
     if input.is_key_released(bk.KeyCode.L):
         is_key_l_pressed = False
 
@@ -209,9 +212,11 @@ def on_update(input, dt, t):
         if not is_key_o_pressed:
             is_key_o_pressed = True
             run_optimizer = not run_optimizer
+            worker.set_running(run_optimizer)
     if input.is_key_released(bk.KeyCode.O):
         is_key_o_pressed = False
 
+    worker.apply_updates(city)
     city.update(dt, t)
 
     if dynamic_light:
@@ -227,8 +232,5 @@ def on_update(input, dt, t):
         pos = light_rotation * starting_pos
         light.set_directional_light(Vec3(0.0) - pos)
 
-    if run_optimizer:
-        optimizer.step()
-
 
 app.run(win)
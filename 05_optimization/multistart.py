@@ -0,0 +1,179 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from city import City
+from optimizer import Optimizer
+
+"""
+This file contains a multi-start runner for the optimizer.
+
+A single `Optimizer.optimize` run follows one trajectory from one random layout.
+The runner instead starts M independent optimizations, each on its own headless
+city with its own seed, in a pool of worker processes, and returns the best layout
+together with the scores of all starts. Every start is reproducible from the seed
+of the runner, no matter how many workers are used.
+
+The runner can also be used from the command line, it prints the results as JSON:
+
+    python multistart.py --starts 64 --size 10 --steps 200 --strategy annealing
+
+To show the best layout in a window, construct its buildings on a city with
+`city.set_layout(result.layout)`.
+"""
+
+
+class ReportProgress:
+    """A stopping rule that never stops, it reports (start, step, score) every
+    `every` steps by calling `report`.
+    """
+    def __init__(self, report, start, every):
+        self.report = report
+        self.start = start
+        self.every = every
+
+    def reset(self):
+        pass
+
+    def check(self, step, score, elapsed):
+        if step % self.every == 0:
+            self.report((self.start, step, score))
+        return None
+
+
+class MultiStartResult:
+    """The result of `multi_start`.
+
+    Attributes:
+        layout (np.ndarray):
+            The type grid of the best start.
+        score (float):
+            The score of the best start.
+        best (int):
+            The index of the best start.
+        scores (np.ndarray):
+            The final score of every start.
+        stop_reasons (list):
+            Why every start stopped, see `Optimizer.stop_reason`.
+    """
+    def __init__(self, layouts, scores, stop_reasons):
+        self.scores = np.asarray(scores)
+        self.best = int(np.argmax(self.scores))
+        self.layout = layouts[self.best]
+        self.score = float(self.scores[self.best])
+        self.stop_reasons = stop_reasons
+
+
+def run_start(rows, cols, seed, strategy, n_steps, stopping, optimizer_args, report, start, report_every):
+    """Optimizes a new headless city from `seed` and returns its final type grid,
+    score and stop reason. This runs in the worker processes of `multi_start`.
+    """
+    city = City(None, cols, rows, rng=np.random.default_rng(seed))
+    optimizer = Optimizer(city, strategy=strategy, **optimizer_args)
+    if report is not None:
+        stopping = [*stopping, ReportProgress(report, start, report_every)]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            score = optimizer.optimize(n_steps, stopping=stopping, reset=False)
+    finally:
+        optimizer.close()
+    return city.type_grid.copy(), score, optimizer.stop_reason
+
+
+def multi_start(rows, cols, starts=64, seed=0, strategy="random", n_steps=100, stopping=(), workers=None,
+                progress=None, report_every=10, **optimizer_args):
+    """Runs `starts` independent optimizations of headless rows x cols cities.
+    Args:
+        rows (int):
+            The number of rows of the cities.
+        cols (int):
+            The number of columns of the cities.
+        starts (int):
+            The number of optimizations.
+        seed (int):
+            The seed from which the seed of every start is derived.
+        strategy (str):
+            The search strategy of the optimizers, see `Optimizer.STRATEGIES`.
+        n_steps (int):
+            The maximum number of steps of every optimization.
+        stopping (list):
+            Stopping rules from stopping.py, every start uses its own copy.
+        workers (int):
+            The number of worker processes, defaults to the number of CPUs. 0 runs
+            the starts one after the other in this process.
+        progress (callable):
+            Called as `progress(start, step, score)` in this process every
+            `report_every` steps of every start.
+        report_every (int):
+            The number of steps between two progress reports of a start.
+        optimizer_args:
+            Passed on to the `Optimizer` of every start.
+    Returns:
+        MultiStartResult:
+            The best layout and the scores of all starts.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(starts)
+    workers = os.cpu_count() if workers is None else workers
+    results = [None] * starts
+
+    if workers == 0:
+        report = None if progress is None else (lambda item: progress(*item))
+        for i in range(starts):
+            # every start gets its own schedule and stopping rules, like the copies the
+            # worker processes receive
+            results[i] = run_start(
+                rows, cols, seeds[i], strategy, n_steps, copy.deepcopy(stopping), copy.deepcopy(optimizer_args),
+                report, i, report_every)
+    else:
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=workers) as executor:
+            queue = manager.Queue() if progress is not None else None
+            report = None if queue is None else queue.put
+            futures = {
+                executor.submit(
+                    run_start, rows, cols, seeds[i], strategy, n_steps, stopping, optimizer_args, report, i,
+                    report_every): i
+                for i in range(starts)
+            }
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[futures[future]] = future.result()
+                # stream the progress reports that arrived in the meantime
+                while queue is not None and not queue.empty():
+                    progress(*queue.get())
+
+    layouts, scores, stop_reasons = zip(*results)
+    return MultiStartResult(list(layouts), scores, list(stop_reasons))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many independent optimizations and keep the best one.")
+    parser.add_argument("--size", type=int, default=10, help="rows and columns of the city")
+    parser.add_argument("--starts", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=100, help="optimization steps per start")
+    parser.add_argument("--strategy", default="random", choices=list(Optimizer.STRATEGIES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+    args = parser.parse_args()
+
+    result = multi_start(args.size, args.size, args.starts, args.seed, args.strategy, args.steps,
+                         workers=args.workers)
+    print(json.dumps({
+        "best": result.best,
+        "best_score": result.score,
+        "best_layout": result.layout.tolist(),
+        "scores": result.scores.tolist(),
+        "mean": float(result.scores.mean()),
+        "std": float(result.scores.std()),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
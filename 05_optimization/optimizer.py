@@ -1,17 +1,156 @@
-from random import randint
-from city import BuildingType
-import math
-from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import time
 import numpy as np
+from genetic import layout_swaps, mutate, order_crossover, tournament
+from schedules import GeometricSchedule, metropolis
+from scoring import (PARK_RADIUS, crop_rewards, random_swap_array, score_grid, score_grids, score_swapped_grids,
+                     swap_stack, swapped_grids, ScoreState)
+from tabu import TabuList
+from tempering import ReplicaSet
+
+
+# the shared memory block with the type grid of the optimizer, the shape of that
+# grid and its cached plot scores, in a worker process, see `init_worker`
+_worker_memory = None
+_worker_shape = None
+_worker_state = None
+_worker_generation = None
+
+
+def shared_grid_arrays(memory, shape):
+    """Returns the generation counter, shape (1,), and the type grid stored in the
+    shared memory block of an optimizer. The generation is increased whenever the
+    grid is replaced instead of changed by swaps.
+    """
+    generation = np.ndarray((1,), dtype=np.int64, buffer=memory.buf)
+    grid = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf, offset=generation.nbytes)
+    return generation, grid
+
+
+def init_worker(name, shape):
+    """Attaches a worker process of the optimizer to its shared type grid."""
+    global _worker_memory, _worker_shape
+    _worker_memory = shared_memory.SharedMemory(name=name)
+    _worker_shape = shape
+
+
+def score_candidates(modification_list):
+    """Returns the score change of every list of swaps in `modification_list` when
+    applied to the shared type grid. This runs in the worker processes of the
+    optimizer. Every worker keeps its own `ScoreState` between calls and only
+    replays the swaps that were applied since its last call, the state is only
+    rebuilt when the optimizer replaced the whole grid.
+    """
+    global _worker_state, _worker_generation
+    generation, grid = shared_grid_arrays(_worker_memory, _worker_shape)
+    if _worker_state is None or _worker_generation != generation[0]:
+        _worker_state = ScoreState(grid)
+        _worker_generation = int(generation[0])
+    elif (_worker_state.types != grid).any():
+        _worker_state.apply(layout_swaps(_worker_state.types, grid))
+    return [_worker_state.delta(swaps) for swaps in modification_list]
 
-    
-def pythagoras(x, y):
-    return math.sqrt(math.pow(x, 2) + math.pow(y, 2))
 
 class Optimizer:
-    def __init__(self, city):
-        """An optimizer that iteratively optimizes a given city grid."""
+    # the search strategies and the method implementing one step of each
+    STRATEGIES = {
+        "random": "parallelized_random",
+        "annealing": "simulated_annealing",
+        "batched": "batched_random",
+        "genetic": "genetic",
+        "tabu": "tabu_search",
+        "tempering": "parallel_tempering",
+        "lns": "large_neighbourhood_search",
+    }
+
+    def __init__(self, city, workers=0, strategy="random", schedule=None, rng=None, verbose=True):
+        """An optimizer that iteratively optimizes a given city grid.
+        Args:
+            city (City):
+                The city to optimize.
+            workers (int):
+                The number of worker processes used to score candidates in
+                `parallelized_random` and the population of `genetic`, and to run
+                the chains of `parallel_tempering`, 0 does all work in this process.
+            strategy (str):
+                The search strategy used by `step`, one of `STRATEGIES`.
+            schedule:
+                The cooling schedule of the "annealing" strategy, see schedules.py.
+                Defaults to a `GeometricSchedule`.
+            rng (np.random.Generator):
+                The random number generator used for all proposals, defaults to the
+                generator of the city so that a seeded city gives a reproducible run.
+            verbose (bool):
+                Whether `optimize` and the steps print their progress. The detailed
+                output requested with `print_info` is printed either way.
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy!r}, expected one of {list(self.STRATEGIES)}.")
         self._city = city
+        self._rng = rng if rng is not None else city.rng
+        self.strategy = strategy
+        self.verbose = verbose
+        self.schedule = schedule if schedule is not None else GeometricSchedule()
+        self.stop_reason = None
+        # called with the list of swaps every time swaps are applied to the city
+        self.on_apply = None
+        self._state = ScoreState(city.type_grid)
+        # the population of the "genetic" strategy and its scores
+        self._population = None
+        self._population_scores = None
+        # the recent swaps and the best score seen by the "tabu" strategy
+        self.tabu = TabuList()
+        self._tabu_best = self._state.total
+        # the chains of the "tempering" strategy
+        self._replicas = None
+        self._workers = workers
+        self._executor = None
+        # the type grid shared with the worker processes, kept in sync by `sync` and
+        # `apply_swaps`
+        self._shared = None
+        if workers > 0:
+            types = self._state.types
+            self._shared = shared_memory.SharedMemory(create=True, size=8 + types.size)
+            self._shared_generation, self._shared_types = shared_grid_arrays(self._shared, types.shape)
+            self._shared_generation[0] = 0
+            self._shared_types[...] = types
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker, initargs=(self._shared.name, types.shape))
+
+    def close(self):
+        """Shuts down the worker processes of the optimizer, if any, and releases the
+        shared memory of the tempering chains.
+        """
+        self._close_replicas()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._shared is not None:
+            del self._shared_generation, self._shared_types
+            self._shared.close()
+            self._shared.unlink()
+            self._shared = None
+
+    def sync(self):
+        """Rebuilds the cached plot scores from the city grid and resets the search
+        state of the strategies, including the cooling schedule. Call this after the
+        city grid was changed without going through the optimizer.
+        """
+        self._state = ScoreState(self._city.type_grid)
+        self.schedule.reset()
+        if self._shared is not None:
+            self._shared_types[...] = self._state.types
+            self._shared_generation[0] += 1
+        self._population = None
+        self.tabu.clear()
+        self._tabu_best = self._state.total
+        self._close_replicas()
+
+    def _close_replicas(self):
+        if self._replicas is not None:
+            self._replicas.close()
+            self._replicas = None
 
     def step(self, print_info=False):
         """Performs a single optimization step.
@@ -19,30 +158,56 @@ class Optimizer:
             print_info (bool):
                 Whether to print information about the optimization step.
         """
-        return self.parallelized_random(print_info)
+        return getattr(self, self.STRATEGIES[self.strategy])(print_info)
 
-    def optimize(self, n_steps=100, print_info=False):
+    def optimize(self, n_steps=100, print_info=False, stopping=(), reset=True):
         """
-        Runs the optimizer for a fixed number of steps.
+        Runs the optimizer for at most a fixed number of steps.
         Args:
             n_steps (int):
-                The number of optimization steps.
+                The maximum number of optimization steps.
             print_info (bool):
                 Whether to print information about the optimization step.
+            stopping (list):
+                Stopping rules from stopping.py, the optimization stops as soon as
+                one of them reports a reason. The reason is printed and stored in
+                `stop_reason`.
+            reset (bool):
+                Whether to reset the city grid first, otherwise the optimization
+                continues from the current layout.
+        Returns:
+            float:
+                The final score.
         """
-        # TODO: Change this method to add a stopping criterion, e.g. stop when
-        #  the score does not improve anymore.
-        self._city.reset_grid()
-        print("Initial scores: ", self._city.compute_sunlight_scores())
-        print("Initial scores sum: ", sum(self._city.compute_sunlight_scores()))
-        print("Initial city layout: ")
-        self._city.print_plots()
-        print("Optimizing...")
+        for rule in stopping:
+            rule.reset()
+        if reset:
+            self._city.reset_grid()
+        self.sync()
+        if self.verbose:
+            if not self._city.headless:
+                print("Initial scores: ", self._city.compute_sunlight_scores())
+                print("Initial scores sum: ", sum(self._city.compute_sunlight_scores()))
+            print("Initial city layout: ")
+            self._city.print_plots()
+            print("Optimizing...")
+        score = self._state.total
+        self.stop_reason = f"reached {n_steps} steps"
+        start = time.perf_counter()
         for i in range(n_steps):
-            print(f"Step: {i}", end="\r")
+            if self.verbose:
+                print(f"Step: {i}", end="\r")
             score = self.step(print_info)
-            # TODO: Add a stopping criterion here.
-        print(f"\nDone! Final score: {score}")
+            elapsed = time.perf_counter() - start
+            reasons = [rule.check(i, score, elapsed) for rule in stopping]
+            reasons = [reason for reason in reasons if reason is not None]
+            if reasons:
+                self.stop_reason = reasons[0]
+                break
+        if self.verbose:
+            print(f"\nDone! Final score: {score}")
+            print(f"Stopped: {self.stop_reason}")
+        return score
 
     # this function creates k versions of the grid and applies n-m swaps to each
     # the best version (can be original) is selected and will be the result of this step
@@ -51,19 +216,20 @@ class Optimizer:
         
         modification_list = [[]] # empty array is to carry over the input as a possible output
         for i in range(k):
-            swap_count = randint(n, m)
+            swap_count = int(self._rng.integers(n, m + 1))
             swaps = []
             for j in range(swap_count):
                 swap = self.random_swap_coords()
                 swaps.append(swap)
             modification_list.append(swaps)
 
-        # evaluate random versions
-        scores = []    
-        for swap_arr in modification_list:
-            self.apply_swaps(swap_arr)
-            scores.append(self.score())
-            self.apply_swaps(reversed(swap_arr))
+        # evaluate random versions, only the plots around the swaps are rescored
+        base = self._state.total
+        if self._executor is None:
+            deltas = [self.delta_score(swap_arr) for swap_arr in modification_list]
+        else:
+            deltas = self.parallel_delta_scores(modification_list)
+        scores = [base + delta for delta in deltas]
 
         # select best
         best = scores.index(max(scores))
@@ -74,22 +240,265 @@ class Optimizer:
             print("New scores sum: ", scores[best])
             print("New city layout: ")
             self._city.print_plots()
-        print(scores[best])
+        if self.verbose:
+            print(scores[best])
         return scores[best]
 
 
 
+    # this function works like parallelized_random, but builds the k versions as
+    # (chunk, rows, cols) stacks of type grids and scores each stack in a single
+    # vectorized pass, so a step can afford hundreds of versions; the chunks hold at
+    # most `score_swapped_grids`' max_cells plots, which bounds the memory use on large
+    # grids, but the time per step still grows with k * rows * cols
+    def batched_random(self, print_info, k=256, n=2, m=20):
+        rows, cols = self._state.types.shape
+        counts = self._rng.integers(n, m + 1, k)
+        # version 0 carries over the input
+        counts[0] = 0
+        swaps = random_swap_array(self._rng, rows, cols, counts, m)
+
+        # evaluate all versions at once and select the best
+        scores = score_swapped_grids(self._state.types, swaps)
+        best = int(np.argmax(scores))
+        self.apply_swaps(
+            ((row1, col1), (row2, col2)) for row1, col1, row2, col2 in swaps[best, :counts[best]].tolist())
+
+        if print_info:
+            print("Best version: ", best, "/", k)
+            print("New scores sum: ", self._state.total)
+            print("New city layout: ")
+            self._city.print_plots()
+        return self._state.total
+
+    # this function evolves a population of layouts for one generation: the best
+    # `elite` layouts survive, the others are replaced by children of tournament
+    # winners (see genetic.py), and the city moves to the best layout if it improves
+    def genetic(self, print_info, population=32, elite=2, mutation=4):
+        rng = self._rng
+        types = self._state.types
+        if self._population is None:
+            # start from the current layout and random variations of it
+            self._population = np.repeat(types[None], population, axis=0)
+            counts = rng.integers(1, mutation + 1, population - 1)
+            swap_stack(self._population[1:], random_swap_array(rng, *types.shape, counts, mutation))
+            self._population_scores = self.score_population(self._population)
+        current, scores = self._population, self._population_scores
+
+        parents = tournament(scores, rng, 2 * (len(current) - elite)).reshape(-1, 2)
+        children = np.stack([order_crossover(current[a], current[b], rng) for a, b in parents])
+        mutate(children, rng, mutation)
+        survivors = np.argsort(scores)[::-1][:elite]
+        self._population = np.concatenate([current[survivors], children])
+        self._population_scores = np.concatenate([scores[survivors], self.score_population(children)])
+
+        best = int(np.argmax(self._population_scores))
+        if self._population_scores[best] > self._state.total:
+            self.apply_swaps(layout_swaps(types, self._population[best]))
+
+        if print_info:
+            print("Population scores: ", np.sort(self._population_scores)[::-1])
+            print("New scores sum: ", self._state.total)
+            print("New city layout: ")
+            self._city.print_plots()
+        return self._state.total
+
+    # this function moves to the best of a few random swaps in every move, even when it
+    # lowers the score, while recently swapped pairs are tabu so the search does not
+    # undo its last moves; a tabu swap is only allowed when it beats the best score seen
+    def tabu_search(self, print_info, moves=50, neighbourhood=20):
+        cols = self._state.cols
+        types = self._state.types.ravel()
+        for i in range(moves):
+            # swaps between plots of the same type can not change the layout
+            pairs = self._rng.integers(0, types.size, (neighbourhood, 2))
+            pairs = pairs[types[pairs[:, 0]] != types[pairs[:, 1]]]
+            best_delta, best_pair = None, None
+            for a, b in pairs.tolist():
+                delta = self.delta_score([((a // cols, a % cols), (b // cols, b % cols))])
+                if (a, b) in self.tabu and self._state.total + delta <= self._tabu_best:
+                    continue
+                if best_delta is None or delta > best_delta:
+                    best_delta, best_pair = delta, (a, b)
+            if best_pair is None:
+                continue
+            a, b = best_pair
+            self.apply_swaps([((a // cols, a % cols), (b // cols, b % cols))])
+            self.tabu.add(a, b)
+            self._tabu_best = max(self._tabu_best, self._state.total)
+
+        if print_info:
+            print("Best score: ", self._tabu_best)
+            print("New scores sum: ", self._state.total)
+            print("New city layout: ")
+            self._city.print_plots()
+        return self._state.total
+
+    # this function runs one sweep of replica exchange: every chain of the temperature
+    # ladder runs `sweep` Metropolis proposals (in the worker processes if there are
+    # any), then neighbouring chains offer to exchange layouts (see tempering.py);
+    # the city moves to the best layout of all chains if it improves
+    def parallel_tempering(self, print_info, replicas=4, sweep=500, t_min=0.01, t_max=1.0):
+        if self._replicas is None:
+            self._replicas = ReplicaSet(self._state.types, np.geomspace(t_min, t_max, replicas))
+        seeds = self._rng.integers(2 ** 63, size=len(self._replicas.temperatures))
+        self._replicas.sweep(sweep, seeds, self._executor)
+        self._replicas.exchange(self._rng)
+
+        layout, score = self._replicas.best()
+        if score > self._state.total:
+            self.apply_swaps(layout_swaps(self._state.types, layout))
+
+        if print_info:
+            print("Temperatures: ", self._replicas.temperatures)
+            print("Replica scores: ", self._replicas.scores)
+            print("Acceptance rates: ", self._replicas.acceptance_rates)
+            print("Exchange rates: ", self._replicas.exchange_rates)
+            print("New scores sum: ", self._state.total)
+            print("New city layout: ")
+            self._city.print_plots()
+        return self._state.total
+
+    # this function destroys a window of the grid by shuffling its buildings and repairs
+    # it by repeatedly applying the best swap inside the window, the window is kept if
+    # it scores better than before; windows are centred on low scoring plots more often
+    def large_neighbourhood_search(self, print_info, window=5, passes=20):
+        rng = self._rng
+        types = self._state.types
+        rows, cols = types.shape
+        h, w = min(window, rows), min(window, cols)
+        weights = self._state.scores.max() - self._state.scores + 1e-3
+        center = int(rng.choice(types.size, p=weights / weights.sum()))
+        top = min(max(center // cols - h // 2, 0), rows - h)
+        left = min(max(center % cols - w // 2, 0), cols - w)
+
+        # swaps inside the window only change the scores of plots up to PARK_RADIUS
+        # away, and those scores only look PARK_RADIUS further, so the score
+        # differences of this part of the grid are the score differences of the whole
+        # grid, as long as rules 1 and 5 use the rewards of the whole grid
+        margin = 2 * PARK_RADIUS
+        row0, col0 = max(top - margin, 0), max(left - margin, 0)
+        crop = (slice(row0, min(top + h + margin, rows)), slice(col0, min(left + w + margin, cols)))
+        part = types[crop].copy()
+        rewards = crop_rewards(rows, cols, crop)
+        before = score_grid(part, rewards)
+
+        # destroy
+        block = part[top - row0:top - row0 + h, left - col0:left - col0 + w]
+        buildings = block.ravel().copy()
+        rng.shuffle(buildings)
+        block[...] = buildings.reshape(h, w)
+
+        # repair, all swaps of two plots in the window are scored in one batched pass
+        a, b = np.triu_indices(h * w, 1)
+        pairs = np.stack([a // w, a % w, b // w, b % w], axis=1) + (top - row0, left - col0, top - row0, left - col0)
+        score = score_grid(part, rewards)
+        for i in range(passes):
+            candidates = pairs[part[pairs[:, 0], pairs[:, 1]] != part[pairs[:, 2], pairs[:, 3]]][:, None]
+            if len(candidates) == 0:
+                break
+            scores = score_grids(swapped_grids(part, candidates), rewards)
+            best = int(np.argmax(scores))
+            if scores[best] <= score:
+                break
+            swap_stack(part[None], candidates[best][None])
+            score = scores[best]
+
+        if score > before:
+            swaps = [
+                ((row1 + top, col1 + left), (row2 + top, col2 + left))
+                for (row1, col1), (row2, col2) in layout_swaps(types[top:top + h, left:left + w], block)]
+            # only keep the window if the incremental scorer of the whole grid agrees
+            if self.delta_score(swaps) > 0:
+                self.apply_swaps(swaps)
+
+        if print_info:
+            print("Window: ", (top, left), "to", (top + h, left + w))
+            print("Window improvement: ", max(score - before, 0))
+            print("New scores sum: ", self._state.total)
+            print("New city layout: ")
+            self._city.print_plots()
+        return self._state.total
+
+    @property
+    def replicas(self) -> ReplicaSet:
+        """Returns the chains of the "tempering" strategy, with their acceptance and
+        exchange rates, or None before its first step.
+        """
+        return self._replicas
+
+    # this function proposes single random swaps and accepts them with the Metropolis
+    # criterion at the temperature of the cooling schedule, so worse layouts are
+    # sometimes accepted to escape local optima
+    def simulated_annealing(self, print_info, proposals=1000):
+        accepted = 0
+        for i in range(proposals):
+            swap = [self.random_swap_coords()]
+            delta = self.delta_score(swap)
+            is_accepted = metropolis(delta, self.schedule.temperature, self._rng.random())
+            if is_accepted:
+                self.apply_swaps(swap)
+                accepted += 1
+            self.schedule.update(is_accepted)
+
+        if print_info:
+            print("Accepted proposals: ", accepted, "/", proposals)
+            print("Temperature: ", self.schedule.temperature)
+            print("New scores sum: ", self._state.total)
+            print("New city layout: ")
+            self._city.print_plots()
+        return self._state.total
+
     def random_swap_coords(self):
         row_size = self._city._plots_per_row
         col_size = self._city._plots_per_col
-        row1, col1 = randint(0, row_size - 1), randint(0, col_size - 1)
-        row2, col2 = randint(0, row_size - 1), randint(0, col_size - 1)
+        row1, col1, row2, col2 = self._rng.integers(0, (row_size, col_size, row_size, col_size)).tolist()
         return ((row1, col1), (row2, col2))
 
     def apply_swaps(self, swap_arr):
+        swap_arr = list(swap_arr)
         for i, current in enumerate(swap_arr):
             ((row1, col1), (row2, col2)) = current
             self._city.swap_buildings(row1, col1, row2, col2)
+            if self._shared is not None:
+                grid = self._shared_types
+                grid[row1, col1], grid[row2, col2] = grid[row2, col2], grid[row1, col1]
+        self._state.apply(swap_arr)
+        if self.on_apply is not None:
+            self.on_apply(swap_arr)
+
+    def delta_score(self, swaps):
+        """Returns how much the score changes when the given swaps are applied,
+        without changing the city. Only the plots near the swapped cells are
+        rescored, so the cost depends on the number of swaps and not on the size
+        of the grid.
+        Args:
+            swaps (list):
+                A list of ((row1, col1), (row2, col2)) swaps, applied in order.
+        """
+        return self._state.delta(swaps)
+
+    def parallel_delta_scores(self, modification_list):
+        """Returns `delta_score` of every list of swaps in `modification_list`,
+        computed by the worker processes. Every worker reads the type grid from shared
+        memory and receives a contiguous chunk of the candidates, the results are
+        returned in the order of `modification_list`.
+        """
+        chunk_size = -(-len(modification_list) // self._workers)
+        futures = [
+            self._executor.submit(score_candidates, modification_list[i:i + chunk_size])
+            for i in range(0, len(modification_list), chunk_size)
+        ]
+        return [delta for future in futures for delta in future.result()]
+
+    def score_population(self, population):
+        """Returns the score of every type grid in a (P, rows, cols) population, the
+        population is split over the worker processes if there are any.
+        """
+        if self._executor is None:
+            return score_grids(population)
+        chunks = np.array_split(population, self._workers)
+        return np.concatenate(list(self._executor.map(score_grids, chunks)))
     
     # rules:
     # 1. skyscrapers/highrises should be near the center
@@ -100,57 +509,4 @@ class Optimizer:
     # 4. To encourage competitiveness each office should be directly neighboured by another office
     # 5. To make a compact city, empty tiles should be away from the center and near the border
     def score(self):
-        score = 0
-
-        num_rows = self._city.rows
-        num_cols = self._city.cols
-        for i in range(num_rows):
-            for j in range(num_cols):
-                type = self._city.get_building_type(i, j)
-                if type == BuildingType.EMPTY: # rule 5
-                    offset_row = i - num_rows/2
-                    offset_col = j - num_cols/2
-                    score += np.clip(pythagoras(offset_row, offset_col) / 20, 0, 1)
-                elif type == BuildingType.HIGHRISE or type == BuildingType.SKYSCRAPER: # rule 1
-                    offset_row = i - num_rows/2
-                    offset_col = j - num_cols/2
-                    distance = pythagoras(offset_row, offset_col)
-                     
-                    score += (1 - np.clip(distance-5 / 15, 0, 1)) * 0.8
-                elif type == BuildingType.HOUSE: # rule 2
-                    neighbours = []
-                    neighbours.append((i-1,j-1))
-                    neighbours.append((i-1,j+1))
-                    neighbours.append((i+1,j-1))
-                    neighbours.append((i+1,j+1))
-                    neighbours.append((i,j-1))
-                    neighbours.append((i,j+1))
-                    neighbours.append((i+1,j))
-                    neighbours.append((i+1,j))
-                    types = [self._city.get_building_type(row, col) for (row, col) in neighbours if 0 <= row < num_rows and 0 <= col < num_cols]
-                    if types.count(BuildingType.HOUSE) >= 3:
-                        score += 0.8
-                elif type == BuildingType.OFFICE: # rule 4
-                    neighbours = []
-                    neighbours.append((i,j-1))
-                    neighbours.append((i,j+1))
-                    neighbours.append((i+1,j))
-                    neighbours.append((i+1,j))
-                    types = [self._city.get_building_type(row, col) for (row, col) in neighbours if 0 <= row < num_rows and 0 <= col < num_cols]
-                    if BuildingType.OFFICE in types:
-                        score += 0.8
-                if type != BuildingType.PARK and type != BuildingType.EMPTY: # rule 3
-                    row_list = range(i-3, i+4)
-                    col_list = range(j-3, j+4)
-                    neighbours = product(row_list, col_list)
-                    types = [(row, col, self._city.get_building_type(row, col)) for (row, col) in neighbours if 0 <= row < num_rows and 0 <= col < num_cols]
-                    park_distances = [pythagoras(row-i, col-j) for (row, col, bt) in types if bt is BuildingType.PARK]
-                    closest = min(park_distances, default=5)
-                    if closest <= 1.5:
-                        score += 0.2
-                    elif closest <= 3.5:
-                        score += (closest - 1.5) * 0.1
-                if type == BuildingType.PARK:
-                    score += 1
-        return score
-    
+        return score_grid(self._city.type_grid)
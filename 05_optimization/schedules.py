@@ -0,0 +1,128 @@
+import math
+
+"""
+This file contains the cooling schedules used by the simulated annealing strategy
+of the Optimizer.
+
+A schedule keeps track of the current temperature. The optimizer reads the
+`temperature` before every proposal and calls `update` afterwards with whether the
+proposal was accepted, so the schedule can cool down (or heat up again). `reset`
+is called when an optimization starts, so the same schedule can be used for
+multiple runs.
+"""
+
+
+class GeometricSchedule:
+    """Multiplies the temperature by `alpha` after every proposal.
+
+    Args:
+        t0 (float):
+            The starting temperature.
+        alpha (float):
+            The cooling factor, slightly below 1.
+        t_min (float):
+            The lowest temperature the schedule cools down to.
+    """
+    def __init__(self, t0=1.0, alpha=0.99995, t_min=1e-4):
+        self.t0 = t0
+        self.alpha = alpha
+        self.t_min = t_min
+        self.reset()
+
+    def reset(self):
+        self.temperature = self.t0
+
+    def update(self, accepted):
+        self.temperature = max(self.temperature * self.alpha, self.t_min)
+
+
+class LinearSchedule:
+    """Lowers the temperature linearly from `t0` to `t_end` in `n_proposals`
+    proposals, after which it stays at `t_end`.
+
+    Args:
+        t0 (float):
+            The starting temperature.
+        t_end (float):
+            The final temperature.
+        n_proposals (int):
+            The number of proposals to reach the final temperature.
+    """
+    def __init__(self, t0=1.0, t_end=1e-4, n_proposals=200000):
+        self.t0 = t0
+        self.t_end = t_end
+        self.step_size = (t0 - t_end) / n_proposals
+        self.reset()
+
+    def reset(self):
+        self.temperature = self.t0
+
+    def update(self, accepted):
+        self.temperature = max(self.temperature - self.step_size, self.t_end)
+
+
+class AdaptiveSchedule:
+    """Steers the temperature towards a target acceptance rate.
+
+    After every `window` proposals the measured acceptance rate is compared to the
+    target: the temperature is lowered when too many proposals were accepted and
+    raised when too few were. The target itself decays by `decay` after every
+    window, so the search slowly turns greedy.
+
+    Args:
+        t0 (float):
+            The starting temperature.
+        target (float):
+            The starting target acceptance rate.
+        window (int):
+            The number of proposals between two adjustments.
+        factor (float):
+            How much the temperature changes per adjustment, below 1.
+        decay (float):
+            How much the target acceptance rate decays per adjustment.
+        t_min (float):
+            The lowest temperature of the schedule.
+    """
+    def __init__(self, t0=1.0, target=0.4, window=1000, factor=0.9, decay=0.99, t_min=1e-4):
+        self.t0 = t0
+        self.target0 = target
+        self.window = window
+        self.factor = factor
+        self.decay = decay
+        self.t_min = t_min
+        self.reset()
+
+    def reset(self):
+        self.temperature = self.t0
+        self.target = self.target0
+        self._proposals = 0
+        self._accepted = 0
+
+    @property
+    def acceptance_rate(self):
+        """Returns the acceptance rate of the current window."""
+        return self._accepted / max(self._proposals, 1)
+
+    def update(self, accepted):
+        self._proposals += 1
+        self._accepted += accepted
+        if self._proposals < self.window:
+            return
+        if self.acceptance_rate > self.target:
+            self.temperature *= self.factor
+        else:
+            self.temperature /= self.factor
+        self.temperature = max(self.temperature, self.t_min)
+        self.target *= self.decay
+        self._proposals = 0
+        self._accepted = 0
+
+
+def metropolis(delta, temperature, u):
+    """Returns whether a proposal that changes the score by `delta` is accepted at
+    the given temperature, where `u` is a uniform random number in [0, 1).
+    Improvements are always accepted, since the optimizer maximizes the score.
+    """
+    if delta >= 0:
+        return True
+    return u < math.exp(delta / temperature)
@@ -0,0 +1,448 @@
+from functools import lru_cache
+
+import numpy as np
+from city import BuildingType, NEIGHBOURS_8, NEIGHBOURS_R3, neighbour_tables
+
+"""
+This file contains the vectorized scoring engine used by the Optimizer.
+
+Instead of walking the city plot by plot, the scorer works on an integer array
+of building types (see `City.type_grid`) with shape (rows, cols). Every rule is
+evaluated for all plots at once by looking at shifted views of a padded copy of
+that array, which is the NumPy way of doing a small convolution.
+
+The rules are the same as the ones described in optimizer.py:
+
+1. skyscrapers/highrises should be near the center
+2. houses should be near atleast 3 other houses in the nearby 8 tiles
+3. every non-empty tile should be as close as possible to the nearest park
+4. each office should be directly neighboured by another office
+5. empty tiles should be away from the center and near the border
+"""
+
+EMPTY = BuildingType.EMPTY.value
+HOUSE = BuildingType.HOUSE.value
+OFFICE = BuildingType.OFFICE.value
+HIGHRISE = BuildingType.HIGHRISE.value
+SKYSCRAPER = BuildingType.SKYSCRAPER.value
+PARK = BuildingType.PARK.value
+
+# value used for plots outside the grid, it never matches a building type
+OUTSIDE = 255
+
+# the park rule only looks 3 plots away in every direction
+PARK_RADIUS = 3
+
+# neighbours (row offset, col offset) that count for rule 2, (1, 0) is counted
+# twice and (-1, 0) not at all, exactly like the original per-plot scorer
+HOUSE_NEIGHBOURS = ((-1, -1), (-1, 1), (1, -1), (1, 1), (0, -1), (0, 1), (1, 0), (1, 0))
+
+# neighbours that count for rule 4, again matching the original scorer
+OFFICE_NEIGHBOURS = ((0, -1), (0, 1), (1, 0))
+
+# offsets of the park rule window that can still earn points (distance <= 3.5),
+# sorted by distance so the closest park wins
+PARK_OFFSETS = sorted(
+    (
+        (dr, dc, float(np.hypot(dr, dc)))
+        for dr in range(-PARK_RADIUS, PARK_RADIUS + 1)
+        for dc in range(-PARK_RADIUS, PARK_RADIUS + 1)
+        if (dr, dc) != (0, 0) and np.hypot(dr, dc) <= 3.5
+    ),
+    key=lambda offset: offset[2],
+)
+
+# the columns of `NeighbourTables.index_r3` in `PARK_OFFSETS`, and their distance
+PARK_COLUMNS = np.array([NEIGHBOURS_R3.index((dr, dc)) for dr, dc, _ in PARK_OFFSETS])
+PARK_DISTANCES = np.array([distance for _, _, distance in PARK_OFFSETS])
+
+
+# weight of every offset of `NEIGHBOURS_8` for rule 2, and the offsets of
+# `NEIGHBOURS_8` that count for rule 4, to score plots with the neighbour tables
+HOUSE_WEIGHTS = np.array([HOUSE_NEIGHBOURS.count(offset) for offset in NEIGHBOURS_8], dtype=np.int8)
+OFFICE_COLUMNS = np.array([NEIGHBOURS_8.index(offset) for offset in OFFICE_NEIGHBOURS])
+
+
+@lru_cache(maxsize=None)
+def center_distance(rows, cols):
+    """Returns the distance of every plot to the center of the grid. The field only
+    depends on the grid shape, so it is computed once per shape and shared; the
+    returned array is read-only.
+    Args:
+        rows (int):
+            The number of rows in the city grid.
+        cols (int):
+            The number of columns in the city grid.
+    """
+    row_offsets = np.arange(rows)[:, None] - rows / 2
+    col_offsets = np.arange(cols)[None, :] - cols / 2
+    center = np.hypot(row_offsets, col_offsets)
+    center.flags.writeable = False
+    return center
+
+
+@lru_cache(maxsize=None)
+def position_rewards(rows, cols):
+    """Returns the reward of every building type on every plot for the rules that
+    only depend on the position of a plot: rule 1, rule 5 and the constant reward
+    of parks. The table has shape (len(BuildingType), rows * cols), so the reward
+    of a flat type array is `rewards[types, np.arange(rows * cols)]`. Like
+    `center_distance` it is computed once per grid shape, shared by all scorers
+    and read-only.
+    """
+    center = center_distance(rows, cols).ravel()
+    rewards = np.zeros((len(BuildingType), rows * cols))
+    rewards[EMPTY] = np.clip(center / 20, 0, 1)
+    # `distance - 5 / 15` keeps the operator precedence of the original rule 1
+    rewards[HIGHRISE] = (1 - np.clip(center - 5 / 15, 0, 1)) * 0.8
+    rewards[SKYSCRAPER] = rewards[HIGHRISE]
+    rewards[PARK] = 1
+    rewards.flags.writeable = False
+    return rewards
+
+
+def park_reward(closest):
+    """Returns the rule 3 reward given the distance to the closest park."""
+    return np.where(closest <= 1.5, 0.2, np.where(closest <= 3.5, (closest - 1.5) * 0.1, 0.0))
+
+
+def shifted_views(types):
+    """Returns a function (dr, dc) -> view of `types` shifted by (dr, dc) along
+    the last two axes, where plots outside the grid are `OUTSIDE`. Offsets up to
+    `PARK_RADIUS` are allowed.
+    """
+    rows, cols = types.shape[-2:]
+    pad = PARK_RADIUS
+    padded = np.pad(types, [(0, 0)] * (types.ndim - 2) + [(pad, pad), (pad, pad)], constant_values=OUTSIDE)
+
+    def shifted(dr, dc):
+        return padded[..., pad + dr:pad + dr + rows, pad + dc:pad + dc + cols]
+    return shifted
+
+
+def park_distance(types):
+    """Returns the distance of every plot to the closest park within 3.5 plots
+    (not counting the plot itself), or 5 if there is none, with the shape of
+    `types`.
+    """
+    shifted = shifted_views(types)
+    closest = np.full(types.shape, 5.0)
+    for dr, dc, distance in reversed(PARK_OFFSETS):
+        closest[shifted(dr, dc) == PARK] = distance
+    return closest
+
+
+def park_distance_at(flat, plots, tables):
+    """Returns the distance of the given plots to the closest park, like
+    `park_distance`, gathering their radius-3 neighbours from the neighbour tables.
+    Args:
+        flat (np.ndarray):
+            The flat building types followed by an `OUTSIDE` sentinel.
+        plots (np.ndarray):
+            The flat indices of the plots.
+        tables (NeighbourTables):
+            The neighbour tables of the grid.
+    """
+    # offsets further away than 3.5 can not earn points and are not gathered
+    parks = flat[tables.index_r3[plots[:, None], PARK_COLUMNS]] == PARK
+    return np.where(parks, PARK_DISTANCES, 5.0).min(axis=1)
+
+
+def plot_scores(types, closest=None, rewards=None):
+    """Returns the score of every plot in the grid.
+    Args:
+        types (np.ndarray):
+            The building type of every plot, shape (rows, cols), or a stack of
+            grids with shape (k, rows, cols).
+        closest (np.ndarray):
+            The `park_distance` of the grid, computed when not given.
+        rewards (np.ndarray):
+            The position rewards of the plots, shape (len(BuildingType), rows * cols),
+            defaults to `position_rewards(rows, cols)`. Pass `crop_rewards` to score
+            a part of a larger grid.
+    """
+    rows, cols = types.shape[-2:]
+    if rewards is None:
+        rewards = position_rewards(rows, cols)
+    shifted = shifted_views(types)
+
+    # rule 1, rule 5 and parks
+    scores = rewards[types, np.arange(rows * cols).reshape(rows, cols)]
+
+    # rule 2
+    houses = np.zeros(types.shape, dtype=np.int8)
+    for dr, dc in HOUSE_NEIGHBOURS:
+        houses += shifted(dr, dc) == HOUSE
+    scores[(types == HOUSE) & (houses >= 3)] += 0.8
+
+    # rule 4
+    offices = np.zeros(types.shape, dtype=bool)
+    for dr, dc in OFFICE_NEIGHBOURS:
+        offices |= shifted(dr, dc) == OFFICE
+    scores[(types == OFFICE) & offices] += 0.8
+
+    # rule 3
+    if closest is None:
+        closest = park_distance(types)
+    built = (types != EMPTY) & (types != PARK)
+    scores[built] += park_reward(closest[built])
+    return scores
+
+
+def score_grid(types, rewards=None):
+    """Returns the total score of the grid, see `plot_scores`."""
+    return float(plot_scores(types, rewards=rewards).sum())
+
+
+def score_grids(stack, rewards=None):
+    """Returns the total score of every grid in a (k, rows, cols) stack of type
+    grids as an array of k scores, in one vectorized pass. See `plot_scores` for
+    `rewards`.
+    """
+    return plot_scores(stack, rewards=rewards).sum(axis=(1, 2))
+
+
+def crop_rewards(rows, cols, crop):
+    """Returns the position rewards of the plots of the (row slice, col slice)
+    `crop` of a rows x cols grid, so that rules 1 and 5 are measured from the
+    center of the whole grid when scoring only that part of it.
+    """
+    rewards = position_rewards(rows, cols).reshape(-1, rows, cols)[(slice(None), *crop)]
+    return rewards.reshape(len(rewards), -1)
+
+
+def swapped_grids(types, swaps):
+    """Returns a (k, rows, cols) stack of copies of `types`, with the swaps of
+    candidate i applied in order to copy i. The swaps are applied to all copies
+    at once, one swap position at a time.
+    Args:
+        types (np.ndarray):
+            The type grid, shape (rows, cols).
+        swaps (np.ndarray):
+            The swaps of every candidate, an integer array of shape (k, s, 4) with
+            rows (row1, col1, row2, col2). A candidate with fewer than s swaps can
+            be padded with swaps of a cell with itself.
+    """
+    stack = np.repeat(np.asarray(types)[None], len(swaps), axis=0)
+    swap_stack(stack, swaps)
+    return stack
+
+
+def score_swapped_grids(types, swaps, max_cells=2 ** 21):
+    """Returns the total score of every candidate of `swapped_grids(types, swaps)`,
+    without building the whole stack: the candidates are copied and scored in
+    chunks of at most `max_cells` plots (at least one grid per chunk). Scoring takes
+    roughly 40 bytes per plot, so the default bounds a chunk to about 80 MB.
+    """
+    chunk = max(1, max_cells // types.size)
+    return np.concatenate([
+        score_grids(swapped_grids(types, swaps[i:i + chunk])) for i in range(0, len(swaps), chunk)])
+
+
+def swap_stack(stack, swaps):
+    """Applies the swaps of candidate i in order to grid i of a (k, rows, cols)
+    stack, in place. See `swapped_grids` for the format of `swaps`.
+    """
+    candidates = np.arange(len(stack))
+    for row1, col1, row2, col2 in np.moveaxis(swaps, 1, 0).transpose(0, 2, 1):
+        first = stack[candidates, row1, col1]
+        stack[candidates, row1, col1] = stack[candidates, row2, col2]
+        stack[candidates, row2, col2] = first
+
+
+def random_swap_array(rng, rows, cols, counts, length):
+    """Returns a (k, length, 4) array of random swaps for `swapped_grids`, where
+    candidate i only uses its first `counts[i]` swaps and the remaining ones swap a
+    cell with itself.
+    """
+    swaps = rng.integers(0, (rows, cols, rows, cols), (len(counts), length, 4))
+    unused = np.arange(length) >= np.asarray(counts)[:, None]
+    swaps[unused, 2:] = swaps[unused, :2]
+    return swaps
+
+
+def plot_scores_at(flat, plots, tables, rewards, closest):
+    """Returns the score of the given plots, gathering their neighbours from the
+    neighbour tables instead of scoring the whole grid. The result is identical to
+    the matching entries of `plot_scores`.
+    Args:
+        flat (np.ndarray):
+            The building type of every plot, flattened, followed by one `OUTSIDE`
+            sentinel for neighbours outside the grid.
+        plots (np.ndarray):
+            The flat indices of the plots to score.
+        tables (NeighbourTables):
+            The neighbour tables of the grid.
+        rewards (np.ndarray):
+            The `position_rewards` of the grid.
+        closest (np.ndarray):
+            The distance of the given plots to the closest park.
+    """
+    # this is called for every proposal of the local search strategies, so the
+    # rules add in place with `where=` instead of masked indexing
+    types = flat[plots]
+    neighbours = flat[tables.index8[plots]]
+
+    # rule 1, rule 5 and parks
+    scores = rewards[types, plots]
+
+    # rule 2
+    houses = (neighbours == HOUSE) @ HOUSE_WEIGHTS
+    np.add(scores, 0.8, out=scores, where=(types == HOUSE) & (houses >= 3))
+
+    # rule 4
+    offices = (neighbours[:, OFFICE_COLUMNS] == OFFICE).any(axis=1)
+    np.add(scores, 0.8, out=scores, where=(types == OFFICE) & offices)
+
+    # rule 3
+    built = (types != EMPTY) & (types != PARK)
+    np.add(scores, park_reward(closest), out=scores, where=built)
+    return scores
+
+
+class ScoreState:
+    """Keeps the per-plot scores of a type grid cached, so that a list of swaps
+    can be scored by only recomputing the plots around the swapped cells.
+
+    A swap changes the type of (at most) two plots. The rules of a plot only look
+    at plots at most `PARK_RADIUS` rows/columns away, so only the changed cells and
+    their radius-3 neighbours (see `NeighbourTables`) need rescoring. Their
+    neighbours are gathered from the precomputed tables with fancy indexing.
+
+    The distance of every plot to the closest park (rule 3) is kept as well. It
+    only changes around cells where a park was swapped in or out, so swaps that
+    do not move a park reuse it as is, and the others only search the parks
+    around the plots within the park radius of those cells.
+
+    Args:
+        types (np.ndarray):
+            The building type of every plot, shape (rows, cols). The state keeps
+            its own copy.
+    """
+    def __init__(self, types):
+        self.rows, self.cols = types.shape
+        self.tables = neighbour_tables(self.rows, self.cols)
+        # flat types with an `OUTSIDE` sentinel, `types` is a 2D view without it
+        self._flat = np.append(np.asarray(types, dtype=np.uint8).ravel(), np.uint8(OUTSIDE))
+        self.types = self._flat[:-1].reshape(self.rows, self.cols)
+        self.rewards = position_rewards(self.rows, self.cols)
+        self.closest = park_distance(self.types).ravel()
+        self.scores = plot_scores(self.types, self.closest.reshape(self.rows, self.cols)).ravel()
+        self.total = float(self.scores.sum())
+        # a changed plot affects itself and its radius-3 neighbours through the
+        # park distance, but only its direct neighbours when no park moved
+        plots = np.arange(self.tables.size, dtype=np.int32)[:, None]
+        self._affected = np.concatenate([plots, self.tables.index_r3], axis=1)
+        self._affected8 = np.concatenate([plots, self.tables.index8], axis=1)
+        # scratch marks to merge the neighbourhoods of two cells, see `_neighbourhood`
+        self._marks = np.zeros(self.tables.size + 1, dtype=bool)
+        # the swaps, the rescored plots, their new scores, the delta and the
+        # updated park distances of the last call to `delta`
+        self._last = None
+
+    def _swap(self, swaps):
+        """Applies the swaps to the type grid and returns the changed (flat) cells
+        and the cells where a park was added or removed.
+        """
+        changed = []
+        parks = []
+        flat = self._flat
+        cols = self.cols
+        for (row1, col1), (row2, col2) in swaps:
+            i, j = row1 * cols + col1, row2 * cols + col2
+            if flat[i] != flat[j]:
+                if flat[i] == PARK or flat[j] == PARK:
+                    parks.append(i)
+                    parks.append(j)
+                flat[i], flat[j] = flat[j], flat[i]
+                changed.append(i)
+                changed.append(j)
+        return changed, parks
+
+    def _neighbourhood(self, cells, radius=PARK_RADIUS):
+        """Returns the sorted plots within `radius` (`PARK_RADIUS` or 1) of the cells."""
+        affected = self._affected if radius == PARK_RADIUS else self._affected8
+        if len(cells) == 2:
+            # fast path for a single swap: the neighbourhoods of the two cells only
+            # share plots when the cells are at most 2 * radius apart, and the
+            # shared plots are dropped by marking the plots of the first one
+            first, second = affected[cells[0]], affected[cells[1]]
+            i, j = cells
+            if abs(i // self.cols - j // self.cols) <= 2 * radius \
+                    and abs(i % self.cols - j % self.cols) <= 2 * radius:
+                marks = self._marks
+                marks[first] = True
+                second = second[~marks[second]]
+                marks[first] = False
+            plots = np.concatenate((first, second))
+            plots.sort()
+        else:
+            plots = np.unique(affected[cells])
+        # neighbours outside the grid are `size`, sorted to the end
+        return plots[:plots.searchsorted(self.tables.size)]
+
+    def _rescore(self, changed, parks):
+        """Returns the plots affected by the changed cells, their new scores, the
+        delta, and the plots whose park distance changed with their new distance.
+        """
+        if parks:
+            # every plot near a moved park lies in `plots`, since parks only move
+            # between changed cells
+            plots = self._neighbourhood(changed)
+            if len(parks) == len(changed):
+                # every changed cell moved a park, like any single swap with a park
+                closest = park_distance_at(self._flat, plots, self.tables)
+                moved = (plots, closest)
+            else:
+                closest = self.closest[plots]
+                near = self._neighbourhood(parks)
+                near_closest = park_distance_at(self._flat, near, self.tables)
+                closest[plots.searchsorted(near)] = near_closest
+                moved = (near, near_closest)
+        else:
+            # without a moved park only rule 2 and 4 look at other plots, and
+            # those only at the 8 direct neighbours
+            plots = self._neighbourhood(changed, radius=1)
+            closest = self.closest[plots]
+            moved = None
+        scores = plot_scores_at(self._flat, plots, self.tables, self.rewards, closest)
+        return plots, scores, float((scores - self.scores[plots]).sum()), moved
+
+    def delta(self, swaps):
+        """Returns how much the total score changes when the swaps are applied in
+        order, without changing the state.
+        Args:
+            swaps (list):
+                A list of ((row1, col1), (row2, col2)) swaps.
+        """
+        swaps = list(swaps)
+        changed, parks = self._swap(swaps)
+        if not changed:
+            return 0.0
+        plots, scores, delta, moved = self._rescore(changed, parks)
+        self._swap(reversed(swaps))
+        self._last = (swaps, plots, scores, delta, moved)
+        return delta
+
+    def apply(self, swaps):
+        """Applies the swaps in order and updates the cached scores.
+        Returns:
+            float:
+                The new total score.
+        """
+        swaps = list(swaps)
+        changed, parks = self._swap(swaps)
+        if self._last is not None and self._last[0] == swaps:
+            # the swaps were just scored by `delta`, reuse the rescored plots
+            _, plots, scores, delta, moved = self._last
+        elif changed:
+            plots, scores, delta, moved = self._rescore(changed, parks)
+        else:
+            plots, scores, delta, moved = [], [], 0.0, None
+        self._last = None
+        self.total += delta
+        self.scores[plots] = scores
+        if moved is not None:
+            near, near_closest = moved
+            self.closest[near] = near_closest
+        return self.total
@@ -0,0 +1,107 @@
+from collections import deque
+
+"""
+This file contains the stopping rules used by `Optimizer.optimize`.
+
+A stopping rule is checked after every optimization step with the step number,
+the current score and the elapsed time in seconds. It returns None to keep going,
+or a short message describing why the optimization should stop. `reset` is called
+when an optimization starts, so the same rule can be used for multiple runs.
+"""
+
+
+class NoImprovement:
+    """Stops when the best score has not improved for `patience` steps.
+
+    Args:
+        patience (int):
+            The number of steps without improvement before stopping.
+        tolerance (float):
+            The minimal increase of the best score that counts as improvement.
+    """
+    def __init__(self, patience=50, tolerance=1e-9):
+        self.patience = patience
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        self._best = float("-inf")
+        self._since_best = 0
+
+    def check(self, step, score, elapsed):
+        if score > self._best + self.tolerance:
+            self._best = score
+            self._since_best = 0
+            return None
+        self._since_best += 1
+        if self._since_best >= self.patience:
+            return f"no improvement for {self.patience} steps"
+        return None
+
+
+class RelativeImprovement:
+    """Stops when the score improved by less than `epsilon` (relative) over the
+    last `window` steps.
+
+    Args:
+        window (int):
+            The number of steps to compare over.
+        epsilon (float):
+            The minimal relative improvement over the window.
+    """
+    def __init__(self, window=100, epsilon=1e-3):
+        self.window = window
+        self.epsilon = epsilon
+        self.reset()
+
+    def reset(self):
+        self._scores = deque(maxlen=self.window + 1)
+
+    def check(self, step, score, elapsed):
+        self._scores.append(score)
+        if len(self._scores) <= self.window:
+            return None
+        oldest = self._scores[0]
+        improvement = (score - oldest) / max(abs(oldest), 1e-12)
+        if improvement < self.epsilon:
+            return f"relative improvement {improvement:.2e} below {self.epsilon:.2e} over {self.window} steps"
+        return None
+
+
+class TimeBudget:
+    """Stops when the optimization has run for `seconds` of wall-clock time.
+
+    Args:
+        seconds (float):
+            The wall-clock budget in seconds.
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def reset(self):
+        pass
+
+    def check(self, step, score, elapsed):
+        if elapsed >= self.seconds:
+            return f"time budget of {self.seconds}s used up"
+        return None
+
+
+class TargetScore:
+    """Stops when the score reaches `target`.
+
+    Args:
+        target (float):
+            The score to reach.
+    """
+    def __init__(self, target):
+        self.target = target
+
+    def reset(self):
+        pass
+
+    def check(self, step, score, elapsed):
+        if score >= self.target:
+            return f"target score {self.target} reached"
+        return None
+
@@ -0,0 +1,41 @@
+"""
+This file contains the tabu list used by the tabu search strategy of the Optimizer.
+
+The tabu list remembers the most recent swaps as unordered pairs of (flat) plot
+indices. Pairs are kept in a dict, which is both a hash set for the membership
+test and ordered by insertion, so the oldest pair can be dropped in constant time
+once the list is full.
+"""
+
+
+class TabuList:
+    """A fixed-size memory of recently swapped plot pairs.
+
+    Args:
+        tenure (int):
+            The number of most recent swaps that are tabu.
+    """
+    def __init__(self, tenure=50):
+        self.tenure = tenure
+        self._pairs = {}
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def __contains__(self, pair):
+        i, j = pair
+        return (min(i, j), max(i, j)) in self._pairs
+
+    def add(self, i, j):
+        """Makes swapping plots i and j tabu, dropping the oldest pair if the list
+        is full.
+        """
+        key = (min(i, j), max(i, j))
+        # re-adding a pair makes it the most recent one again
+        self._pairs.pop(key, None)
+        self._pairs[key] = None
+        if len(self._pairs) > self.tenure:
+            del self._pairs[next(iter(self._pairs))]
+
+    def clear(self):
+        self._pairs.clear()
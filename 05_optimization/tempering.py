@@ -0,0 +1,144 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+from schedules import metropolis
+from scoring import ScoreState
+
+"""
+This file contains the replicas of the parallel tempering strategy of the Optimizer.
+
+Parallel tempering (replica exchange) runs several Metropolis chains on copies of
+the type grid, every chain at its own temperature of a ladder. Hot chains wander
+freely, cold chains climb; after every sweep neighbouring chains offer to exchange
+their layouts, so good layouts found by hot chains sink down to the cold ones.
+
+The layouts and scores of all chains live in one shared memory block, so the
+sweeps can run in the worker processes of the optimizer, each on its own grid,
+without sending grids back and forth. The exchanges are done by the optimizer
+process between the sweeps.
+"""
+
+
+def replica_arrays(memory, replicas, shape):
+    """Returns the scores, shape (replicas,), and the type grids, shape
+    (replicas, rows, cols), stored in a shared memory block.
+    """
+    scores = np.ndarray((replicas,), dtype=np.float64, buffer=memory.buf)
+    grids = np.ndarray((replicas, *shape), dtype=np.uint8, buffer=memory.buf, offset=scores.nbytes)
+    return scores, grids
+
+
+def _sweep(memory, replicas, shape, index, temperature, proposals, seed):
+    scores, grids = replica_arrays(memory, replicas, shape)
+    state = ScoreState(grids[index])
+    rng = np.random.default_rng(seed)
+    rows, cols = shape
+    coords = rng.integers(0, (rows, cols, rows, cols), (proposals, 4)).tolist()
+    accepted = 0
+    for (row1, col1, row2, col2), u in zip(coords, rng.random(proposals).tolist()):
+        swap = [((row1, col1), (row2, col2))]
+        if metropolis(state.delta(swap), temperature, u):
+            state.apply(swap)
+            accepted += 1
+    grids[index] = state.types
+    scores[index] = state.total
+    return accepted
+
+
+def run_replica(name, replicas, shape, index, temperature, proposals, seed):
+    """Runs `proposals` single swap Metropolis proposals on replica `index` of the
+    shared memory block `name` and stores its new layout and score there. This runs
+    in the worker processes of the optimizer.
+    Returns:
+        int:
+            The number of accepted proposals.
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        return _sweep(memory, replicas, shape, index, temperature, proposals, seed)
+    finally:
+        memory.close()
+
+
+class ReplicaSet:
+    """The chains of a parallel tempering run, one per temperature.
+
+    Args:
+        types (np.ndarray):
+            The type grid every chain starts from.
+        temperatures (list):
+            The temperature ladder, from cold to hot.
+    """
+    def __init__(self, types, temperatures):
+        self.temperatures = np.asarray(temperatures, dtype=float)
+        self.shape = types.shape
+        replicas = len(self.temperatures)
+        self._memory = shared_memory.SharedMemory(create=True, size=replicas * (8 + types.size))
+        self.scores, self.grids = replica_arrays(self._memory, replicas, self.shape)
+        self.grids[:] = types
+        self.scores[:] = ScoreState(types).total
+        # proposals and accepted proposals per temperature, and exchange attempts
+        # and accepted exchanges per pair of neighbouring temperatures
+        self._proposals = np.zeros(replicas)
+        self._accepted = np.zeros(replicas)
+        self._exchanges = np.zeros(replicas - 1)
+        self._exchanged = np.zeros(replicas - 1)
+
+    @property
+    def acceptance_rates(self) -> np.ndarray:
+        """Returns the fraction of accepted proposals at every temperature."""
+        return self._accepted / np.maximum(self._proposals, 1)
+
+    @property
+    def exchange_rates(self) -> np.ndarray:
+        """Returns the fraction of accepted exchanges between every pair of
+        neighbouring temperatures.
+        """
+        return self._exchanged / np.maximum(self._exchanges, 1)
+
+    def sweep(self, proposals, seeds, executor=None):
+        """Runs `proposals` proposals on every chain, in the worker processes of
+        `executor` if given.
+        Args:
+            proposals (int):
+                The number of proposals per chain.
+            seeds (list):
+                The seed of the random number generator of every chain.
+            executor (ProcessPoolExecutor):
+                The worker processes, None runs the chains one after the other.
+        """
+        replicas = len(self.temperatures)
+        args = (
+            [self._memory.name] * replicas, [replicas] * replicas, [self.shape] * replicas,
+            range(replicas), self.temperatures, [proposals] * replicas, seeds,
+        )
+        if executor is None:
+            accepted = list(map(run_replica, *args))
+        else:
+            accepted = list(executor.map(run_replica, *args))
+        self._proposals += proposals
+        self._accepted += accepted
+
+    def exchange(self, rng):
+        """Offers an exchange of layouts to every pair of neighbouring temperatures,
+        from cold to hot, accepted with the replica exchange Metropolis criterion.
+        """
+        t = self.temperatures
+        for i in range(len(t) - 1):
+            self._exchanges[i] += 1
+            delta = (self.scores[i + 1] - self.scores[i]) * (1 / t[i] - 1 / t[i + 1])
+            if metropolis(delta, 1.0, rng.random()):
+                self.grids[[i, i + 1]] = self.grids[[i + 1, i]]
+                self.scores[[i, i + 1]] = self.scores[[i + 1, i]]
+                self._exchanged[i] += 1
+
+    def best(self):
+        """Returns a copy of the best layout of all chains and its score."""
+        i = int(np.argmax(self.scores))
+        return self.grids[i].copy(), float(self.scores[i])
+
+    def close(self):
+        """Releases the shared memory block."""
+        del self.scores, self.grids
+        self._memory.close()
+        self._memory.unlink()
@@ -0,0 +1,106 @@
+import queue
+import threading
+from city import City
+from optimizer import Optimizer
+
+"""
+This file contains the OptimizerWorker, which runs the optimizer in a background
+thread so the render loop never has to wait for a scoring pass.
+
+The worker optimizes a headless copy of the city (see `City` with app=None), which
+only tracks building types. Every step that changes the layout publishes the
+applied swaps through a queue. The render loop calls `apply_updates` once per
+frame, which replays the published swaps on the real city and so brings it to the
+latest layout. Moving buildings is cheap (see `City.update`), so the frame rate
+does not depend on how fast the optimizer runs.
+"""
+
+
+class OptimizerWorker(threading.Thread):
+    """Runs an optimizer on a headless copy of a city in a background thread.
+
+    Args:
+        city (City):
+            The city to optimize, its layout is copied when the worker is created.
+        rng (np.random.Generator):
+            The random number generator of the headless copy and its optimizer,
+            defaults to a child generator spawned from `city.rng`, so a seeded city
+            gives a reproducible optimization.
+        **optimizer_args:
+            Extra arguments passed to the `Optimizer` of the worker.
+    """
+    def __init__(self, city, rng=None, **optimizer_args):
+        super().__init__(daemon=True)
+        # the generator is not shared with `city`, which is used by the render thread
+        rng = rng if rng is not None else city.rng.spawn(1)[0]
+        self.city = City(None, city.plots_per_col, city.plots_per_row, rng=rng)
+        self.city.set_layout(city.type_grid)
+        # printing every step would flood the console and compete with the render
+        # thread, only steps requested with `step_once(print_info=True)` print
+        optimizer_args.setdefault("verbose", False)
+        self.optimizer = Optimizer(self.city, rng=rng, **optimizer_args)
+        self.optimizer.on_apply = self._record
+        # published (swaps, score) batches, in the order they were applied
+        self.updates = queue.Queue()
+        self._batch = []
+        self._print_info = False
+        self._running = threading.Event()
+        self._step_once = threading.Event()
+        self._stopped = threading.Event()
+
+    def _record(self, swaps):
+        self._batch.extend(swaps)
+
+    @property
+    def running(self) -> bool:
+        """Returns whether the worker is optimizing continuously."""
+        return self._running.is_set()
+
+    def set_running(self, running: bool):
+        """Starts or pauses continuous optimization."""
+        if running:
+            self._running.set()
+        else:
+            self._running.clear()
+
+    def step_once(self, print_info=False):
+        """Requests a single optimization step while the worker is paused.
+        Args:
+            print_info (bool):
+                Whether to print information about the optimization step.
+        """
+        self._print_info = print_info
+        self._step_once.set()
+
+    def stop(self):
+        """Stops the worker thread after the current step."""
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            if not self._running.is_set():
+                if not self._step_once.wait(0.05):
+                    continue
+                self._step_once.clear()
+            self._batch = []
+            score = self.optimizer.step(self._print_info)
+            self._print_info = False
+            if self._batch:
+                self.updates.put((self._batch, score))
+        self.optimizer.close()
+
+    def apply_updates(self, city):
+        """Replays all swaps published since the last call on the given city.
+        Returns:
+            float:
+                The score of the latest published layout, or None if nothing was
+                published since the last call.
+        """
+        score = None
+        while True:
+            try:
+                swaps, score = self.updates.get_nowait()
+            except queue.Empty:
+                return score
+            for (row1, col1), (row2, col2) in swaps:
+                city.swap_buildings(row1, col1, row2, col2)